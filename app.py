@@ -1,11 +1,32 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 from shiny import App, render, ui, reactive
 import pandas as pd
 import matplotlib.pyplot as plt
-import numpy as np
-import random
 
-from plot_pain import plot_pain_over_time
-from patientclass import patientPainGenerator
+from plot_pain import plot_pain_over_time, plot_cohort_fan_chart
+from cohort_analytics import summarise_cohort
+from cohort_cache import CohortCache
+from cohort_generation import _cohort_patient_args, _simulate_patient, TriangularDAS
+from cohort_store import CohortStore
+
+# Generated patients are shared by every session, keyed by their content (seed, index, noise, DAS)
+cohort_cache = CohortCache(max_patients=5000)
+
+# Optional pre-generated cohort (see cohort_store / batch_generate --format store), memory-mapped
+# once per process so every session pages in only the patients it shows
+cohort_store = CohortStore.open(os.environ["COHORT_STORE"]) if os.environ.get("COHORT_STORE") else None
+
+# Worker pool shared by every session, started on the first generation
+worker_pool = None
+
+def get_worker_pool():
+    global worker_pool
+    if worker_pool is None:
+        worker_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+    return worker_pool
 
 app_ui = ui.page_sidebar(
     ui.sidebar(
@@ -19,12 +40,19 @@ app_ui = ui.page_sidebar(
 
         ui.hr(),
         ui.input_task_button("generate_data", "Generate Dataset"),
+        ui.input_action_button("cancel_generation", "Cancel"),
+        ui.output_text("generation_status"),
         ui.panel_conditional(
             "Object.keys(input).includes('generate_data') && input.generate_data",  # More robust check
             ui.hr(),
             ui.h3("Patient Selection"),
             ui.output_ui("patient_selector")
         ),
+        *([
+            ui.hr(),
+            ui.h3("Stored Cohort"),
+            ui.input_selectize("stored_patient", f"Select Stored Patient ({len(cohort_store)} patients)", choices=[]),
+        ] if cohort_store is not None else []),
         ui.download_button("download_data", "Download Dataset"),
     ),
     ui.card(
@@ -32,6 +60,10 @@ app_ui = ui.page_sidebar(
     ui.output_plot("pain_plot", width="100%", height="500px"),  # Explicit height
     width="100%"  # Make card use full width
     ),
+    ui.card(
+        ui.card_header("Cohort Pain Over Time"),
+        ui.output_plot("cohort_plot", width="100%", height="600px"),
+    ),
     ui.card(
         ui.card_header("Data Table for Patient"),
         ui.output_data_frame("data_table"),
@@ -40,147 +72,203 @@ app_ui = ui.page_sidebar(
 )
 
 def server(input, output, session):
-    # Store all patient data in reactive values
+    # Store all patients in reactive values
     all_patients = reactive.value([])
-    selected_patient_data = reactive.value(None)
-    
-    import random 
+    selected_patient = reactive.value(None)
+    # Patients shown in the cohort fan chart, only updated on progress steps so streaming stays linear
+    cohort_patients = reactive.value([])
+
+    generation_progress = reactive.value((0, 0)) # (patients ready, patients requested)
+
+    @ui.bind_task_button(button_id="generate_data")
+    @reactive.extended_task
+    async def generation_task(patient_amount, noise, seed, days):
+        das_sampler = TriangularDAS(low=1.6, high=8, mode=4.3)
+        print(f"Generating data for {patient_amount} patients")
+        print(f"Noise amplitude: {noise}")
+        
+        # Only simulate the displayed days and patients not generated before,
+        # patients are extended if more days are requested later
+        keys, cached = cohort_cache.plan_cohort(patient_amount, das_sampler, noise, seed, days)
+        loop = asyncio.get_running_loop()
+        pending = []
+        for index, patient in enumerate(cached):
+            if patient is None:
+                patient_args = _cohort_patient_args(1, das_sampler, noise, seed, index, days)[0]
+                pending.append(loop.run_in_executor(get_worker_pool(), _simulate_patient, patient_args))
+            else:
+                pending.append(patient)
+        
+        patients = []
+        cohort_step = max(1, patient_amount // 10) # redraw the fan chart about ten times per generation
+        try:
+            # Publish patients in order as they finish so the selector and plot fill in early
+            for key, item in zip(keys, pending):
+                if isinstance(item, asyncio.Future):
+                    patient = await item
+                    if seed is not None: # patients without a seed are random every time, never cache them
+                        cohort_cache.put(key, patient)
+                else:
+                    patient = item
+                patients.append(patient)
+                print(f"Patient {patient.id}: DAS score = {patient.das_score}, days simulated = {patient.days}")
+                
+                async with reactive.lock():
+                    all_patients.set(list(patients))
+                    generation_progress.set((len(patients), patient_amount))
+                    if len(patients) % cohort_step == 0 or len(patients) == patient_amount:
+                        cohort_patients.set(list(patients))
+                    # Initialize with first patient's data
+                    if len(patients) == 1:
+                        selected_patient.set(patient)
+                    await reactive.flush()
+        except asyncio.CancelledError:
+            # Drop the patients that have not started yet
+            for item in pending:
+                if isinstance(item, asyncio.Future):
+                    item.cancel()
+            print(f"Generation cancelled after {len(patients)} patients")
+            raise
+        
+        print(f"Created {len(patients)} patients (cache hits: {cohort_cache.hits}, misses: {cohort_cache.misses})")
+        return patients
 
     @reactive.Effect
     @reactive.event(input.generate_data)
     def generate_patient_data():
-        try:
-            random.seed(input.seed_value())
-            # Generate data for the specified number of patients
-            patients = []
-            patient_dataframes = []
-            
-            print(f"Generating data for {input.patient_amount()} patients")
-            
-            for i in range(1, input.patient_amount() + 1):
-                # Generate a random DAS score for each patient
-                das_score = random.triangular(1.6, 8, 4.3)
-                print(f"Patient {i}: DAS score = {das_score}")
-                
-                # Initialize patient with selected parameters
-                noise_amplitude = input.noise()
-                print(f"Noise amplitude: {noise_amplitude}")
-                
-                try:
-                    patient = patientPainGenerator(
-                        id=i,
-                        das_score=das_score,
-                        noise_amplitude=noise_amplitude,
-                    )
-                    patients.append(patient)
-                    
-                    # Get the data for this patient
-                    df = patient.get_pain_dataframe()
-                    if df is not None and not df.empty:
-                        print(f"Patient {i} dataframe shape: {df.shape}")
-                        patient_dataframes.append(df)
-                    else:
-                        print(f"Error: Patient {i} dataframe is empty or None")
-                except Exception as e:
-                    print(f"Error creating patient {i}: {str(e)}")
-            
-            print(f"Created {len(patient_dataframes)} patient dataframes")
-            
-            # Store all patient dataframes
-            all_patients.set(patient_dataframes)
-            
-            # Initialize with first patient's data
-            if patient_dataframes:
-                selected_patient_data.set(patient_dataframes[0])
-                print(f"Selected patient data set, shape: {patient_dataframes[0].shape}")
-            else:
-                print("No patient dataframes were created")
-        except Exception as e:
-            print(f"Error in generate_patient_data: {str(e)}")
-            import traceback
-            traceback.print_exc()
+        all_patients.set([])
+        cohort_patients.set([])
+        selected_patient.set(None)
+        generation_progress.set((0, input.patient_amount()))
+        generation_task(
+            input.patient_amount(),
+            input.noise(),
+            input.seed_value(),
+            input.days_to_display() + 1,
+        )
+
+    @reactive.Effect
+    @reactive.event(input.cancel_generation)
+    def cancel_generation():
+        generation_task.cancel()
+        cohort_patients.set(all_patients()) # chart the patients generated so far
+
+    @render.text
+    def generation_status():
+        status = generation_task.status()
+        ready, requested = generation_progress()
+        if status == "initial":
+            return ""
+        if status == "running":
+            return f"Generating patients: {ready}/{requested}"
+        if status == "cancelled":
+            return f"Generation cancelled ({ready}/{requested} patients)"
+        if status == "error":
+            return f"Generation failed: {generation_task.error()}"
+        return f"Generated {ready} patients"
         
     @output
     @render.ui
     def patient_selector():
         # Create dropdown list of patients if data exists
-        patients_data = all_patients()
-        if not patients_data:
+        patients = all_patients()
+        if not patients:
             return ui.p("No patient data available")
         
-        # Create options for dropdown - Patient ID (DAS Score: X.X)
-        options = [
-            f"Patient {int(df['patient_id'].iloc[0])} (DAS: {df['das_score'].iloc[0]:.1f})"
-            for df in patients_data
-        ]
+        # Create options for dropdown - patient index -> Patient ID (DAS Score: X.X)
+        options = {
+            str(index): f"Patient {patient.id} (DAS: {patient.das_score:.1f})"
+            for index, patient in enumerate(patients)
+        }
+        
+        # Keep the current choice while patients are still being added
+        with reactive.isolate():
+            current = input.selected_patient() if input.selected_patient.is_set() else None
         
         # Create patient selector dropdown
         return ui.input_select(
             "selected_patient", 
             "Select Patient", 
-            choices=options
+            choices=options,
+            selected=current if current in options else None
         )
     
     @reactive.effect
     @reactive.event(input.selected_patient)
     def update_selected_patient():
-        patients_data = all_patients()
-        if not patients_data or not input.selected_patient():
+        patients = all_patients()
+        if not patients or not input.selected_patient():
             return
         
-        # Extract patient index from selection (Patient X...)
-        try:
-            patient_idx = int(input.selected_patient().split()[1]) - 1
-            if 0 <= patient_idx < len(patients_data):
-                selected_patient_data.set(patients_data[patient_idx])
-        except (ValueError, IndexError):
-            pass
+        # The selected value is the patient index
+        patient_idx = int(input.selected_patient())
+        if 0 <= patient_idx < len(patients):
+            selected_patient.set(patients[patient_idx])
+
+    if cohort_store is not None:
+        @reactive.effect
+        def fill_stored_patients():
+            # Choices are sent to the browser as they are searched, not all at once
+            ui.update_selectize("stored_patient", choices=cohort_store.labels(), server=True)
+
+        @reactive.effect
+        @reactive.event(input.stored_patient)
+        def select_stored_patient():
+            if input.stored_patient():
+                selected_patient.set(cohort_store.patient(int(input.stored_patient())))
+
+    @reactive.calc
+    def displayed_data():
+        patient = selected_patient()
+        if patient is None:
+            return None
+        
+        # Limit to the first X days, simulating further only if those days do not exist yet
+        days_to_display = input.days_to_display()
+        patient.simulate(days_to_display + 1)
+        df = patient.get_pain_dataframe()
+        return df[df['day'] <= days_to_display]
     
     @render.plot
     def pain_plot():
-        df = selected_patient_data()
-        if df is None:
+        filtered_df = displayed_data()
+        if filtered_df is None:
             fig, ax = plt.subplots(figsize=(10, 6))
             ax.text(0.5, 0.5, "Press 'Generate Dataset' to see data",
                 ha='center', va='center', fontsize=14)
             ax.axis('off')
             return fig
         
-        # Limit to the first X days instead of the last X days
-        days_to_display = input.days_to_display()
-        min_day = df['day'].min()
-        max_day = min_day + days_to_display
-        filtered_df = df[df['day'] <= max_day]
-        
-        return plot_pain_over_time(filtered_df, show_plot=False)
+        return plot_pain_over_time(filtered_df, show_plot=False, reuse_figure=True)
     
+    @render.plot
+    def cohort_plot():
+        patients = cohort_patients()
+        if not patients:
+            fig, ax = plt.subplots(figsize=(10, 6))
+            ax.text(0.5, 0.5, "Press 'Generate Dataset' to see data",
+                ha='center', va='center', fontsize=14)
+            ax.axis('off')
+            return fig
+
+        summary = summarise_cohort(patients, days=input.days_to_display() + 1)
+        return plot_cohort_fan_chart(summary, reuse_figure=True)
+
     @render.data_frame
     def data_table():
-        df = selected_patient_data()
-        if df is None:
+        filtered_df = displayed_data()
+        if filtered_df is None:
             return pd.DataFrame()
         
-        # Apply the same filtering as in the plot
-        days_to_display = input.days_to_display()
-        min_day = df['day'].min()
-        max_day = min_day + days_to_display
-        filtered_df = df[df['day'] <= max_day]
-        
         return filtered_df.sort_values('day', ascending=True)
     
     @render.download(filename="pain_treatment_data.csv")
     def download_data():
-        df = selected_patient_data()
-        if df is None or df.empty:
+        filtered_df = displayed_data()
+        if filtered_df is None or filtered_df.empty:
             # Return an empty DataFrame with appropriate columns if no data
             return pd.DataFrame(columns=["day", "pain_score", "patient_id", "das_score"])
         
-        # Apply the same filtering as in the plot and table
-        days_to_display = input.days_to_display()
-        min_day = df['day'].min()
-        max_day = min_day + days_to_display
-        filtered_df = df[df['day'] <= max_day]
-        
         return filtered_df
 
 app = App(app_ui, server)
@@ -0,0 +1,112 @@
+import argparse
+import logging
+import time
+
+from cohort_generation import TriangularDAS
+from cohort_writer import write_cohort, ENGINES
+
+logger = logging.getLogger("batch_generate")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic cohort and write it straight to disk (no browser or plotting needed)")
+    parser.add_argument("output", help="Output directory (parquet, store) or file (csv)")
+    parser.add_argument("-n", "--patients", type=int, required=True, help="Number of patients")
+    parser.add_argument("--das-low", type=float, default=1.6, help="Lowest DAS score of the triangular distribution")
+    parser.add_argument("--das-mode", type=float, default=4.3, help="Most likely DAS score")
+    parser.add_argument("--das-high", type=float, default=8, help="Highest DAS score")
+    parser.add_argument("--noise", type=float, default=1.2, help="Noise amplitude for every patient")
+    parser.add_argument("--days", type=int, default=1000, help="Simulation horizon per patient (including day 0)")
+    parser.add_argument("--seed", type=int, default=None, help="Master seed of the cohort (default fresh entropy)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default every core)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Patients simulated and written per chunk")
+    parser.add_argument("--format", dest="file_format", choices=("auto", "parquet", "csv", "store"), default="auto",
+                        help="Output format, auto uses parquet when pyarrow is installed, "
+                             "store writes a memory-mapped CohortStore for the app and analysis")
+    parser.add_argument("--engine", choices=ENGINES, default="reference",
+                        help="reference: one patientPainGenerator per patient, vectorised: CohortSimulator per chunk")
+    parser.add_argument("--dynamic-das", action="store_true",
+                        help="Let DMARDs and flares change each patient's DAS score during the run")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Skip the per-chunk progress lines")
+    args = parser.parse_args(argv)
+
+    if args.patients < 1:
+        parser.error("--patients must be at least 1")
+    if args.days < 1:
+        parser.error("--days must be at least 1")
+    if not args.das_low <= args.das_mode <= args.das_high:
+        parser.error("DAS distribution needs --das-low <= --das-mode <= --das-high")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    das_sampler = TriangularDAS(low=args.das_low, high=args.das_high, mode=args.das_mode)
+    logger.info("Generating %d patients x %d days (%s engine, %s) to %s",
+                args.patients, args.days, args.engine, das_sampler, args.output)
+
+    start = time.perf_counter()
+
+    if args.file_format == "store":
+        write_store(args, das_sampler, start)
+        return
+
+    def log_progress(writer, patients_written):
+        elapsed = time.perf_counter() - start
+        logger.info("%d/%d patients (%.1f%%), %d rows, %.0f patients/s, %.0f rows/s",
+                    patients_written, args.patients, 100 * patients_written / args.patients,
+                    writer.rows_written, patients_written / elapsed, writer.rows_written / elapsed)
+
+    writer = write_cohort(
+        args.output,
+        args.patients,
+        das_sampler=das_sampler,
+        noise=args.noise,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        file_format=args.file_format,
+        days=args.days,
+        engine=args.engine,
+        dynamic_das=args.dynamic_das,
+        progress=None if args.quiet else log_progress
+    )
+
+    elapsed = time.perf_counter() - start
+    logger.info("Wrote %d patients (%d rows, %d chunks) as %s in %.1fs, %.0f patients/s",
+                args.patients, writer.rows_written, writer.chunks_written, writer.file_format,
+                elapsed, args.patients / elapsed)
+
+def write_store(args, das_sampler, start):
+    """
+    Generate the cohort into a memory-mapped CohortStore
+    """
+    from cohort_store import build_cohort_store
+
+    def log_progress(store, patients_written):
+        elapsed = time.perf_counter() - start
+        logger.info("%d/%d patients (%.1f%%), %.0f patients/s",
+                    patients_written, args.patients, 100 * patients_written / args.patients,
+                    patients_written / elapsed)
+
+    store = build_cohort_store(
+        args.output,
+        args.patients,
+        das_sampler=das_sampler,
+        noise=args.noise,
+        seed=args.seed,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        days=args.days,
+        engine=args.engine,
+        dynamic_das=args.dynamic_das,
+        progress=None if args.quiet else log_progress
+    )
+
+    elapsed = time.perf_counter() - start
+    logger.info("Wrote %d patients x %d days to %s in %.1fs, %.0f patients/s",
+                store.n_patients, store.days, store.path, elapsed, args.patients / elapsed)
+
+if __name__ == "__main__":
+    main()
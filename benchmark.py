@@ -0,0 +1,192 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+BENCHMARKS = {} # name -> (setup, repeats), setup returns the callable to time or None to skip
+
+def benchmark(name, repeats=5):
+    """
+    Register a benchmark: the decorated function does the setup and returns the callable that is timed,
+    or None when it cannot run here (e.g. an optional dependency is missing)
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, repeats)
+        return setup
+    return register
+
+#------------- BENCHMARKS -------------#
+
+@benchmark("patient_1k_days")
+def _patient_1k_days():
+    from patientclass import patientPainGenerator
+    return lambda: patientPainGenerator('bench', 6.5, seed=1, days=1000)
+
+@benchmark("patient_10k_days", repeats=3)
+def _patient_10k_days():
+    from patientclass import patientPainGenerator
+    return lambda: patientPainGenerator('bench', 6.5, seed=1, days=10000)
+
+@benchmark("patient_10k_days_numba", repeats=3)
+def _patient_10k_days_numba():
+    from compiled_simulation import numba_available
+    from patientclass import patientPainGenerator
+    if not numba_available():
+        return None # timing the Python fallback under this name would corrupt comparisons
+    patientPainGenerator('bench', 6.5, seed=1, days=10, backend="numba") # compile outside the timing
+    return lambda: patientPainGenerator('bench', 6.5, seed=1, days=10000, backend="numba")
+
+@benchmark("responding_treatment_type_x10k")
+def _responding_treatment_type():
+    from treatment_determination import _responding_treatment_type, PainWindow
+    rng = np.random.default_rng(1)
+    windows = [PainWindow.from_history(dict(enumerate(rng.uniform(1, 10, size=7)))) for _ in range(100)]
+    scores = rng.uniform(1, 10, size=100)
+
+    def run():
+        for _ in range(100):
+            for score, window in zip(scores, windows):
+                _responding_treatment_type(score, window, dmard_use=0)
+    return run
+
+@benchmark("treatment_effect_x10k")
+def _treatment_effect():
+    from treatment_determination import _treatment_effect, TREATMENT_TYPES, NormalBatch
+    rng = np.random.default_rng(1)
+    noise = NormalBatch(rng)
+
+    def run():
+        for day in range(2000):
+            for treatment in TREATMENT_TYPES:
+                _treatment_effect(treatment, day % 400, rng=rng, noise=noise)
+    return run
+
+@benchmark("get_pain_dataframe_10k_days")
+def _get_pain_dataframe():
+    from patientclass import patientPainGenerator
+    patient = patientPainGenerator('bench', 6.5, seed=1, days=10000)
+    return patient.get_pain_dataframe
+
+@benchmark("cohort_1k_patients", repeats=1)
+def _cohort_1k_patients():
+    from cohort_generation import generate_cohort
+    return lambda: generate_cohort(1000, seed=1, workers=1)
+
+@benchmark("cohort_simulator_1k_patients", repeats=3)
+def _cohort_simulator_1k_patients():
+    from cohort_simulator import CohortSimulator
+    das_scores = np.random.default_rng(1).triangular(1.6, 4.3, 8, size=1000)
+    return lambda: CohortSimulator(das_scores, seed=1).run()
+
+#------------- RUNNER -------------#
+
+def _git_commit():
+    try:
+        # Run in the repository, not the working directory, so the commit is found wherever this is started from
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmarks(names=None, repeats=None):
+    """
+    Time the registered benchmarks
+
+    Args:
+        names: Benchmark names to run, None runs all of them
+        repeats: Override the number of timed repeats per benchmark
+
+    Returns:
+        dict: Machine-readable results with the commit, environment and per-benchmark timings in seconds
+    """
+    results = {}
+    for name, (setup, default_repeats) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        run = setup()
+        if run is None:
+            print(f"{name:<36} skipped", file=sys.stderr)
+            continue
+        times = []
+        for _ in range(repeats or default_repeats):
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+        results[name] = {
+            'min': min(times),
+            'median': float(np.median(times)),
+            'repeats': len(times),
+        }
+        print(f"{name:<36} min {min(times):9.4f}s  median {np.median(times):9.4f}s", file=sys.stderr)
+
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'machine': platform.machine(),
+        'benchmarks': results,
+    }
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compare two result files by minimum time
+
+    Args:
+        baseline: Results dict of the reference commit
+        current: Results dict of the new commit
+        threshold: Relative change reported as a speedup or regression
+
+    Returns:
+        list: (name, baseline_min, current_min, ratio, status) per benchmark present in both
+    """
+    rows = []
+    for name, result in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name]['min']
+        ratio = result['min'] / before
+        status = "regression" if ratio > 1 + threshold else "speedup" if ratio < 1 - threshold else "same"
+        rows.append((name, before, result['min'], ratio, status))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the simulator hot paths")
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run (default all): {', '.join(BENCHMARKS)}")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file")
+    parser.add_argument("-r", "--repeats", type=int, help="Override the number of repeats per benchmark")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against a baseline results file")
+    parser.add_argument("--current", metavar="RESULTS",
+                        help="With --compare, compare this results file instead of a fresh run")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change flagged in a comparison")
+    args = parser.parse_args(argv)
+
+    if args.current and not args.compare:
+        parser.error("--current needs --compare")
+
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args.benchmarks, args.repeats)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+        else:
+            print(json.dumps(current, indent=2))
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"{baseline.get('commit')} -> {current.get('commit')}")
+        for name, before, after, ratio, status in compare_results(baseline, current, args.threshold):
+            print(f"{name:<36} {before:9.4f}s -> {after:9.4f}s  x{ratio:5.2f}  {status}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import numpy as np
+
+from flare_determination import FLARE_EVENT
+from treatment_determination import TREATMENT_REGISTRY
+
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+PERCENTILE_BLOCK_DAYS = 256 # days per block when computing percentiles, bounds the temporary copy
+
+def _stacked_arrays(cohort, days=None):
+    """
+    Get the (patients x days) pain and event arrays of a cohort without building DataFrames
+
+    Args:
+        cohort: CohortSimulator, CohortStore or a list of patientPainGenerator objects
+        days: Optional horizon to cut every patient to (including day 0)
+
+    Returns:
+        tuple: (pain, events, treatment_types) - float32 and uint8 arrays, patients cut to the shortest horizon
+    """
+    from cohort_store import CohortStore
+
+    if isinstance(cohort, CohortStore):
+        # Memory-mapped, only the days used are paged in
+        horizon = cohort.days
+        pain, events = cohort.pain, cohort.events
+        treatment_types = cohort.treatment_types
+    elif hasattr(cohort, "pain_history"):
+        horizon = cohort.day
+        pain, events = cohort.pain_history, cohort.events
+        treatment_types = cohort.treatment_types
+    else:
+        patients = list(cohort)
+        if not patients:
+            types = TREATMENT_REGISTRY.types
+            return np.empty((0, days or 0), dtype=np.float32), np.empty((0, days or 0), dtype=np.uint8), types
+        horizon = min(len(patient.pain) for patient in patients)
+        if days is not None:
+            horizon = min(horizon, days)
+        pain = np.stack([patient.pain[:horizon] for patient in patients])
+        events = np.stack([patient.events[:horizon] for patient in patients])
+        treatment_types = patients[0].registry.types
+
+    if days is not None:
+        horizon = min(horizon, days)
+    return pain[:, :horizon], events[:, :horizon], treatment_types
+
+def _pain_percentiles(pain, percentiles=DEFAULT_PERCENTILES):
+    """
+    Per-day pain percentiles across patients, computed in blocks of days
+
+    Returns:
+        numpy.ndarray: (len(percentiles), days) array
+    """
+    bands = np.empty((len(percentiles), pain.shape[1]))
+    if pain.shape[0] == 0:
+        bands.fill(np.nan)
+        return bands
+    for start in range(0, pain.shape[1], PERCENTILE_BLOCK_DAYS):
+        block = pain[:, start:start + PERCENTILE_BLOCK_DAYS]
+        bands[:, start:start + block.shape[1]] = np.percentile(block, percentiles, axis=0)
+    return bands
+
+def _first_treatment_days(events, n_treatments):
+    """
+    Day each patient first started each treatment, from one pass over the non-empty event codes
+
+    Returns:
+        numpy.ndarray: (patients, treatments) int64 array, -1 where the treatment was never started
+    """
+    first = np.full((events.shape[0], n_treatments), -1, dtype=np.int64)
+    codes = events & ~np.uint8(FLARE_EVENT)
+    rows, days = np.nonzero(codes) # row-major, so each patient's starts are in day order
+    treatment_codes = codes[rows, days].astype(np.int64) - 1
+
+    # First occurrence of each (patient, treatment) pair
+    pairs, index = np.unique(rows * n_treatments + treatment_codes, return_index=True)
+    first[pairs // n_treatments, pairs % n_treatments] = days[index]
+    return first
+
+def summarise_cohort(cohort, percentiles=DEFAULT_PERCENTILES, days=None):
+    """
+    Cohort-level statistics from the stacked pain and event arrays, vectorised over all patients
+
+    Treatment days are the days the treatment was started (decided), not
+    shifted back by onset like the started_ columns of the DataFrame export.
+
+    Args:
+        cohort: CohortSimulator, CohortStore or a list of patientPainGenerator objects
+        percentiles: Percentiles of the pain bands
+        days: Optional horizon (including day 0), defaults to the shortest patient
+
+    Returns:
+        dict:
+            - 'n_patients', 'days': cohort size and day numbers
+            - 'percentiles', 'pain_bands': the percentiles and their (len(percentiles), days) pain values
+            - 'mean_pain': mean pain per day
+            - 'flare_rate': fraction of patients flaring per day
+            - 'uptake': treatment -> cumulative fraction of patients started by each day
+            - 'first_start': (patients, treatments) first start day per treatment, -1 if never started
+            - 'time_to_first': 'dmard' / 'biologic' -> dict with 'fraction', 'median_day' and 'mean_day' of the patients who started it
+    """
+    pain, events, treatment_types = _stacked_arrays(cohort, days)
+    n, horizon = pain.shape
+
+    first_start = _first_treatment_days(events, len(treatment_types))
+
+    uptake = {}
+    for code, treatment in enumerate(treatment_types):
+        started = first_start[:, code]
+        counts = np.bincount(started[started >= 0], minlength=horizon)
+        uptake[treatment] = np.cumsum(counts) / max(n, 1)
+
+    time_to_first = {}
+    for treatment in ("dmard", "biologic"):
+        if treatment not in treatment_types:
+            continue
+        started = first_start[:, treatment_types.index(treatment)]
+        started = started[started >= 0]
+        time_to_first[treatment] = {
+            'fraction': len(started) / max(n, 1),
+            'median_day': float(np.median(started)) if len(started) else np.nan,
+            'mean_day': float(started.mean()) if len(started) else np.nan,
+        }
+
+    return {
+        'n_patients': n,
+        'days': np.arange(horizon),
+        'percentiles': tuple(percentiles),
+        'pain_bands': _pain_percentiles(pain, percentiles),
+        'mean_pain': pain.mean(axis=0, dtype=np.float64) if n else np.full(horizon, np.nan),
+        'flare_rate': np.count_nonzero(events & np.uint8(FLARE_EVENT), axis=0) / max(n, 1),
+        'uptake': uptake,
+        'first_start': first_start,
+        'time_to_first': time_to_first,
+    }
@@ -0,0 +1,156 @@
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+from cohort_generation import generate_cohort, TriangularDAS
+from treatment_determination import TREATMENT_REGISTRY
+
+class CohortCache:
+    '''Content-addressed cache of simulated patients with LRU eviction and an optional on-disk tier'''
+    def __init__(self, max_patients=10000, cache_dir=None):
+        """
+        Args:
+            max_patients: Number of patients kept in memory before the least recently used are evicted
+            cache_dir: Optional directory for the on-disk tier, patients there survive eviction and restarts
+        """
+        self.max_patients = max_patients
+        self.cache_dir = cache_dir
+        self._patients = OrderedDict() # key -> patientPainGenerator, most recently used last
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def patient_key(seed, index, noise, das_sampler):
+        """
+        Content address of one patient: everything its simulation depends on apart from the horizon
+
+        Args:
+            seed: Master seed of the cohort
+            index: Zero based patient index within the cohort
+            noise: Noise amplitude
+            das_sampler: DAS sampler, identified by its repr
+
+        Returns:
+            str: Hex digest identifying the patient
+        """
+        profiles = tuple((name, tuple(TREATMENT_REGISTRY[name])) for name in TREATMENT_REGISTRY)
+        content = repr((seed, index, float(noise), repr(das_sampler), profiles))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.pkl")
+
+    def get(self, key):
+        """
+        Look up a patient, checking memory first and then the on-disk tier
+
+        Returns:
+            patientPainGenerator or None: The cached patient, None on a miss
+        """
+        patient = self._patients.get(key)
+        if patient is not None:
+            self._patients.move_to_end(key)
+            self.hits += 1
+            return patient
+
+        if self.cache_dir is not None and os.path.exists(self._disk_path(key)):
+            with open(self._disk_path(key), "rb") as f:
+                patient = pickle.load(f)
+            self._remember(key, patient)
+            self.hits += 1
+            return patient
+
+        self.misses += 1
+        return None
+
+    def put(self, key, patient):
+        """
+        Store a patient in memory and, when configured, on disk
+        """
+        self._remember(key, patient)
+        if self.cache_dir is not None:
+            with open(self._disk_path(key), "wb") as f:
+                pickle.dump(patient, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _remember(self, key, patient):
+        self._patients[key] = patient
+        self._patients.move_to_end(key)
+        while len(self._patients) > self.max_patients:
+            self._patients.popitem(last=False)
+
+    def plan_cohort(self, n, das_sampler=None, noise=1.2, seed=None, days=1000):
+        """
+        Look up every patient of a cohort, extending cached patients to the requested horizon
+
+        Args:
+            n: Number of patients
+            das_sampler: DAS sampler of the cohort (default TriangularDAS())
+            noise: Noise amplitude for every patient
+            seed: Master seed of the cohort, None disables caching (every patient has to be simulated)
+            days: Minimum simulation horizon (including day 0)
+
+        Returns:
+            tuple: (keys, patients) - cache key per patient index (None without a seed), and the cached patient or None when it still has to be simulated
+        """
+        if das_sampler is None:
+            das_sampler = TriangularDAS()
+        if seed is None:
+            return [None] * n, [None] * n
+
+        keys = [self.patient_key(seed, index, noise, das_sampler) for index in range(n)]
+        patients = [self.get(key) for key in keys]
+
+        # Extend cached patients that were simulated over a shorter horizon
+        for key, patient in zip(keys, patients):
+            if patient is not None and patient.days < days:
+                patient.simulate(days)
+                self.put(key, patient)
+
+        return keys, patients
+
+    def get_cohort(self, n, das_sampler=None, noise=1.2, seed=None, workers=1, days=1000):
+        """
+        Return a cohort like generate_cohort, simulating only patients (or days) not already cached
+
+        Patient seeds are derived from the master seed per patient index, so
+        growing a cohort from 50 to 60 patients only simulates the 10 new ones,
+        and a longer horizon only simulates the extra days.
+
+        Args:
+            n: Number of patients
+            das_sampler: Callable taking a numpy Generator and returning a DAS score (default TriangularDAS())
+            noise: Noise amplitude for every patient
+            seed: Master seed of the cohort, None disables caching
+            workers: Number of worker processes used for the missing patients
+            days: Minimum simulation horizon (including day 0) of the returned patients
+
+        Returns:
+            list: patientPainGenerator objects in patient order
+        """
+        if das_sampler is None:
+            das_sampler = TriangularDAS()
+        if seed is None:
+            return generate_cohort(n, das_sampler, noise, seed, workers, days=days)
+
+        keys, patients = self.plan_cohort(n, das_sampler, noise, seed, days)
+
+        # Simulate each contiguous run of missing patients in one batch
+        index = 0
+        while index < n:
+            if patients[index] is not None:
+                index += 1
+                continue
+            run_start = index
+            while index < n and patients[index] is None:
+                index += 1
+            generated = generate_cohort(index - run_start, das_sampler, noise, seed, workers,
+                                        start=run_start, days=days)
+            for offset, patient in enumerate(generated):
+                patients[run_start + offset] = patient
+                self.put(keys[run_start + offset], patient)
+
+        return patients
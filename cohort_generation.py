@@ -0,0 +1,231 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+class TriangularDAS:
+    '''DAS score sampler drawing from a triangular distribution (picklable, usable as a cache key)'''
+    def __init__(self, low=1.6, high=8, mode=4.3):
+        self.low = low
+        self.high = high
+        self.mode = mode
+
+    def __call__(self, rng):
+        return float(rng.triangular(self.low, self.mode, self.high))
+
+    def __repr__(self):
+        return f"TriangularDAS(low={self.low}, high={self.high}, mode={self.mode})"
+
+def _patient_seed_sequence(seed_sequence, index):
+    """
+    Derive the seed sequence of one patient from the cohort master seed
+
+    Args:
+        seed_sequence: Master numpy SeedSequence of the cohort
+        index: Zero based patient index within the cohort
+
+    Returns:
+        numpy.random.SeedSequence: Same child as seed_sequence.spawn(index + 1)[index], without spawning the rest
+    """
+    return np.random.SeedSequence(
+        seed_sequence.entropy,
+        spawn_key=seed_sequence.spawn_key + (index,),
+        pool_size=seed_sequence.pool_size
+    )
+
+def _simulate_patient(patient_args):
+    """
+    Process pool worker: simulate a single patient
+
+    Args:
+        patient_args: Tuple of (id, das_score, seed, noise_amplitude, days, dynamic_das, registry)
+
+    Returns:
+        patientPainGenerator: The simulated patient
+    """
+    from patientclass import patientPainGenerator
+
+    patient_id, das_score, seed, noise_amplitude, days, dynamic_das, registry = patient_args
+    return patientPainGenerator(
+        id=patient_id,
+        das_score=das_score,
+        seed=seed,
+        noise_amplitude=noise_amplitude,
+        registry=registry,
+        days=days,
+        dynamic_das=dynamic_das
+    )
+
+def _cohort_patient_args(n, das_sampler, noise, seed, start, days, dynamic_das=False, registry=None):
+    """
+    Build the worker arguments (id, das_score, seed, noise, days, dynamic_das, registry) for a slice of the cohort
+
+    The registry is resolved here, in the calling process, so workers that
+    start without this process's registrations (the spawn start method)
+    still simulate with the same profiles.
+
+    Returns:
+        list: One argument tuple per patient, DAS scores drawn from each patient's own stream
+    """
+    from treatment_determination import TREATMENT_REGISTRY
+
+    if das_sampler is None:
+        das_sampler = TriangularDAS()
+    if registry is None:
+        registry = TREATMENT_REGISTRY
+
+    master_seed = np.random.SeedSequence(seed)
+    patient_args = []
+    for index in range(start, start + n):
+        das_seed, simulation_seed = _patient_seed_sequence(master_seed, index).spawn(2)
+        das_score = das_sampler(np.random.default_rng(das_seed))
+        patient_args.append((index + 1, das_score, simulation_seed, noise, days, dynamic_das, registry))
+    return patient_args
+
+def iter_cohort_chunks(n, chunk_size, das_sampler=None, noise=1.2, seed=None, workers=1, start=0, days=1000,
+                       dynamic_das=False, registry=None):
+    """
+    Simulate a cohort chunk by chunk so only one chunk of patients is held at a time
+
+    Patients are identical to the ones generate_cohort gives for the same
+    arguments, whatever the chunk size or number of workers.
+
+    Args:
+        n: Number of patients to generate
+        chunk_size: Maximum number of patients per yielded chunk
+        das_sampler: Callable taking a numpy Generator and returning a DAS score (default TriangularDAS())
+        noise: Noise amplitude for every patient
+        seed: Master seed of the cohort (None for fresh entropy)
+        workers: Number of worker processes, 1 runs in this process, None uses every core
+        start: Index of the first patient, ids run from start + 1 to start + n
+        days: Simulation horizon per patient (including day 0), patients can be extended later
+        dynamic_das: True to let DMARDs and flares change each patient's DAS score during the run
+        registry: TreatmentRegistry with the treatment profiles (default TREATMENT_REGISTRY as it is now)
+
+    Yields:
+        list: patientPainGenerator objects of the next chunk, in patient order
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if seed is None:
+        seed = np.random.SeedSequence().entropy # chunks must share one master seed
+
+    chunk_starts = range(start, start + n, chunk_size)
+    if workers <= 1 or n <= 1:
+        for chunk_start in chunk_starts:
+            chunk_n = min(chunk_size, start + n - chunk_start)
+            patient_args = _cohort_patient_args(chunk_n, das_sampler, noise, seed, chunk_start, days, dynamic_das,
+                                                registry)
+            yield [_simulate_patient(args) for args in patient_args]
+        return
+
+    # One pool shared by every chunk
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_start in chunk_starts:
+            chunk_n = min(chunk_size, start + n - chunk_start)
+            patient_args = _cohort_patient_args(chunk_n, das_sampler, noise, seed, chunk_start, days, dynamic_das,
+                                                registry)
+            chunksize = max(1, chunk_n // (workers * 4))
+            yield list(executor.map(_simulate_patient, patient_args, chunksize=chunksize))
+
+def _simulate_cohort_chunk(chunk_args):
+    """
+    Process pool worker: simulate one chunk of the cohort with the vectorised CohortSimulator
+
+    Args:
+        chunk_args: Tuple of (patient_args, seed, days), patient_args as from _cohort_patient_args
+
+    Returns:
+        CohortSimulator: The simulated chunk
+    """
+    from cohort_simulator import CohortSimulator
+
+    patient_args, seed, days = chunk_args
+    ids = [args[0] for args in patient_args]
+    das_scores = [args[1] for args in patient_args]
+    noise, dynamic_das, registry = patient_args[0][3], patient_args[0][5], patient_args[0][6]
+    return CohortSimulator(das_scores, seed=seed, noise_amplitude=noise, days=days, ids=ids, registry=registry,
+                           dynamic_das=dynamic_das).run()
+
+def iter_vectorised_chunks(n, chunk_size, das_sampler=None, noise=1.2, seed=None, workers=1, start=0, days=1000,
+                           dynamic_das=False, registry=None):
+    """
+    Simulate a cohort chunk by chunk with the vectorised CohortSimulator
+
+    DAS scores and ids are the same as iter_cohort_chunks gives, the daily
+    draws come from one stream per chunk so the data is statistically (not
+    bitwise) equivalent to the per-patient engine and depends on chunk_size.
+
+    Args:
+        n: Number of patients to generate
+        chunk_size: Maximum number of patients per yielded chunk
+        das_sampler: Callable taking a numpy Generator and returning a DAS score (default TriangularDAS())
+        noise: Noise amplitude for every patient
+        seed: Master seed of the cohort (None for fresh entropy)
+        workers: Number of worker processes simulating chunks in parallel, None uses every core
+        start: Index of the first patient, ids run from start + 1 to start + n
+        days: Simulation horizon per patient (including day 0)
+        dynamic_das: True to let DMARDs and flares change each patient's DAS score during the run
+        registry: TreatmentRegistry with the treatment profiles (default TREATMENT_REGISTRY as it is now)
+
+    Yields:
+        CohortSimulator: The next simulated chunk, in patient order
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    def chunk_args():
+        master_seed = np.random.SeedSequence(seed)
+        for chunk_start in range(start, start + n, chunk_size):
+            chunk_n = min(chunk_size, start + n - chunk_start)
+            patient_args = _cohort_patient_args(chunk_n, das_sampler, noise, seed, chunk_start, days, dynamic_das,
+                                                registry)
+            # The chunk stream is the third child of its first patient, unused by the per-patient engine
+            chunk_seed = _patient_seed_sequence(master_seed, chunk_start).spawn(3)[2]
+            yield patient_args, chunk_seed, days
+
+    if workers <= 1:
+        for args in chunk_args():
+            yield _simulate_cohort_chunk(args)
+        return
+
+    # Keep only a few chunks in flight so memory stays bounded when writing is slower than simulating
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for args in chunk_args():
+            pending.append(executor.submit(_simulate_cohort_chunk, args))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def generate_cohort(n, das_sampler=None, noise=1.2, seed=None, workers=1, start=0, days=1000, dynamic_das=False,
+                    registry=None):
+    """
+    Simulate a cohort of patients, optionally spread across a process pool
+
+    Every patient gets its own seed derived from the master seed, so the
+    result is identical whatever the number of workers.
+
+    Args:
+        n: Number of patients to generate
+        das_sampler: Callable taking a numpy Generator and returning a DAS score (default TriangularDAS())
+        noise: Noise amplitude for every patient
+        seed: Master seed of the cohort (None for fresh entropy)
+        workers: Number of worker processes, 1 runs in this process, None uses every core
+        start: Index of the first patient, ids run from start + 1 to start + n
+        days: Simulation horizon per patient (including day 0), patients can be extended later
+        dynamic_das: True to let DMARDs and flares change each patient's DAS score during the run
+        registry: TreatmentRegistry with the treatment profiles (default TREATMENT_REGISTRY as it is now)
+
+    Returns:
+        list: patientPainGenerator objects in patient order
+    """
+    patients = []
+    for chunk in iter_cohort_chunks(n, max(n, 1), das_sampler, noise, seed, workers, start, days, dynamic_das,
+                                    registry):
+        patients.extend(chunk)
+    return patients
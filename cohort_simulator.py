@@ -0,0 +1,205 @@
+import numpy as np
+
+from das_score_changes import _reduce_das_on_dmard_array, _increase_das_on_flare_array, DMARD_DAS_INTERVAL
+from flare_determination import _adjusted_flare_chance, _flare_chance_array, _flare_longevity_array, FLARE_PAIN_SCORE, FLARE_EVENT
+from treatment_determination import (
+    _responding_treatment_codes,
+    _treatment_start_matrix,
+    RESPONSE_DECLINE_CHANCE,
+    RESPONSE_DECLINE_MIN,
+    RESPONSE_FLOOR,
+    RESPONSE_REDUCTION_RANGE,
+    TREATMENT_REGISTRY,
+    TREATMENT_RESPONSE_RANGES,
+)
+
+NOISE_STEPS = np.array([-0.5, 0, 0.5]) # daily random pain fluctuation options
+DECISION_WINDOW = 7 # days of pain history used for treatment decisions
+
+class CohortSimulator:
+    '''Cohort class to generate per day pain score data for many patients at once'''
+    def __init__(self, das_scores, seed=None, noise_amplitude=1.2, days=1000, ids=None, registry=None,
+                 dynamic_das=False):
+        """
+        Set up the per-patient state arrays for a cohort
+
+        Args:
+            das_scores: Sequence of DAS scores, one per patient
+            seed: Seed (or numpy SeedSequence) for the cohort random generator
+            noise_amplitude: Random fluctuation amplitude shared by all patients
+            days: Number of days to simulate (including day 0)
+            ids: Optional patient ids, defaults to '1'..'n'
+            registry: TreatmentRegistry with the treatment profiles (default TREATMENT_REGISTRY)
+            dynamic_das: True to let DMARDs and flares change each patient's DAS score during the run
+        """
+        self.rng = np.random.default_rng(seed)
+        self.das_scores = np.asarray(das_scores, dtype=float)
+        self.n_patients = len(self.das_scores)
+        self.ids = np.array([str(i) for i in (ids if ids is not None else range(1, self.n_patients + 1))])
+        self.noise_amplitude = noise_amplitude
+        self.days = days
+        self.registry = registry if registry is not None else TREATMENT_REGISTRY
+        self.treatment_types = self.registry.types
+        n = self.n_patients
+
+        # Per-patient factors (same distributions as patientPainGenerator)
+        self.pain_persistence = self.rng.uniform(0.7, 0.95, size=n)
+        self.treatment_response = np.column_stack([
+            self.rng.uniform(*TREATMENT_RESPONSE_RANGES.get(t, (0, 1)), size=n)
+            for t in self.treatment_types
+        ])
+
+        # Treatment profile columns, indexed by treatment code
+        profiles = np.array([tuple(self.registry[t]) for t in self.treatment_types], dtype=float)
+        self._max_effect = profiles[:, 0]
+        self._onset_days = profiles[:, 1]
+        self._duration_days = profiles[:, 2]
+        self._variability = profiles[:, 3]
+        self._decline_codes = [self.treatment_types.index(t) for t in ("dmard", "biologic") if t in self.registry]
+
+        # Daily state
+        self.day = 1
+        self.pain = np.clip(self.das_scores * 1.8, 1, 10)
+        self.flare_days_remaining = np.zeros(n, dtype=np.int64)
+        self.treatment_days = np.full((n, len(self.treatment_types)), -1, dtype=np.int64) # -1 = not on treatment
+        self.dmard_counter = np.zeros(n, dtype=np.int64)
+        self.dynamic_das = dynamic_das
+        self.das = self.das_scores.copy() # current DAS score per patient
+        self._flare_chance = _adjusted_flare_chance(self.das) # only recomputed for patients whose score changes
+        self._window = np.empty((n, DECISION_WINDOW)) # ring buffer of recent pain, slot = day % window
+        self._window[:, 0] = self.pain
+
+        # Recorded output: pain per day and an event code per day
+        # Event code = treatment code + 1 of a started treatment (0 = none), FLARE_EVENT bit on flare days
+        self.pain_history = np.empty((n, days), dtype=np.float32)
+        self.pain_history[:, 0] = self.pain
+        self.events = np.zeros((n, days), dtype=np.uint8)
+        self.das_history = None # DAS score per day, only recorded when it can change
+        if dynamic_das:
+            self.das_history = np.empty((n, days))
+            self.das_history[:, 0] = self.das
+
+    def step(self):
+        """
+        Advance every patient in the cohort by one day
+        """
+        day = self.day
+        n = self.n_patients
+        rows = np.arange(n)
+        random_factor = self.rng.choice(NOISE_STEPS, size=n)
+
+        #------------- FLARE MODULE -------------#
+        self.flare_days_remaining = np.maximum(self.flare_days_remaining - 1, 0)
+        adjusted_chance_flare = _flare_chance_array(self.das, self.rng, adjusted_chance=self._flare_chance)
+        flare = adjusted_chance_flare > 0
+        flare_duration = _flare_longevity_array(adjusted_chance_flare, self.rng)
+        self.flare_days_remaining = np.where(flare_duration > 0, flare_duration, self.flare_days_remaining)
+        new_pain = self.pain + (self.noise_amplitude * random_factor) + (FLARE_PAIN_SCORE * flare)
+
+        #------------- TREATMENT MODULE -------------#
+        started = np.zeros(n, dtype=bool)
+        if day > DECISION_WINDOW:
+            new_treatment = _responding_treatment_codes(
+                self._window.max(axis=1),
+                self._window.mean(axis=1),
+                self.dmard_counter,
+                treatment_types=self.treatment_types
+            )
+            recommended = new_treatment >= 0
+            started = recommended & (self.treatment_days[rows, np.maximum(new_treatment, 0)] < 0)
+            self.treatment_days[started, new_treatment[started]] = 0
+            self.dmard_counter += started & (new_treatment == self.treatment_types.index("dmard"))
+            self.events[started, day] = new_treatment[started] + 1
+
+        # Apply treatment effects to pain (inc. duration of effect)
+        active = self.treatment_days >= 0
+        days_used = self.treatment_days
+        patient_response = np.ones(days_used.shape)
+        patient_response[active] = self.rng.normal(1.0, np.broadcast_to(self._variability, active.shape)[active])
+        effect = self._max_effect * np.clip(patient_response, 0.1, 1.5)
+        effective = active & (days_used >= self._onset_days)
+        treatment_effect = np.where(effective, effect, 0.0).sum(axis=1)
+
+        expired = active & (days_used >= self._duration_days)
+        self.treatment_days = np.where(active, days_used + 1, days_used)
+        self.treatment_days[expired] = -1
+
+        # Chance to reduce response to treatment to low responder randomly
+        for code in self._decline_codes:
+            response = self.treatment_response[:, code]
+            decline = active[:, code] & (self.rng.random(n) < RESPONSE_DECLINE_CHANCE) & (response > RESPONSE_DECLINE_MIN)
+            if decline.any():
+                reduction = self.rng.uniform(*RESPONSE_REDUCTION_RANGE, size=int(decline.sum()))
+                response[decline] = np.maximum(RESPONSE_FLOOR, response[decline] - reduction)
+
+        new_pain = np.clip(new_pain + treatment_effect, 1, 10)
+
+        # New Pain Data added for this day
+        self.pain = new_pain
+        self._window[:, day % DECISION_WINDOW] = new_pain
+        self.pain_history[:, day] = new_pain
+        self.events[flare, day] |= FLARE_EVENT
+
+        #------------- DAS SCORE MODULE -------------#
+        if self.dynamic_das:
+            days_on_dmard = self.treatment_days[:, self.treatment_types.index("dmard")]
+            changed = ((days_on_dmard > 0) & (days_on_dmard % DMARD_DAS_INTERVAL == 0)) | flare # monthly DMARD steps
+            das = _reduce_das_on_dmard_array(days_on_dmard[changed], self.das[changed])
+            self.das[changed] = _increase_das_on_flare_array(flare[changed], das)
+            self._flare_chance[changed] = _adjusted_flare_chance(self.das[changed])
+            self.das_history[:, day] = self.das
+
+        self.day += 1
+
+    def run(self, days=None):
+        """
+        Simulate the remaining days for the whole cohort, optionally extending the horizon
+
+        Args:
+            days: New total number of days (including day 0), defaults to the current horizon
+
+        Returns:
+            CohortSimulator: self, to allow chaining
+        """
+        if days is not None and days > self.days:
+            extra = days - self.days
+            self.pain_history = np.concatenate(
+                [self.pain_history, np.empty((self.n_patients, extra), dtype=np.float32)], axis=1)
+            self.events = np.concatenate(
+                [self.events, np.zeros((self.n_patients, extra), dtype=np.uint8)], axis=1)
+            if self.das_history is not None:
+                self.das_history = np.concatenate(
+                    [self.das_history, np.empty((self.n_patients, extra))], axis=1)
+            self.days = days
+        while self.day < self.days:
+            self.step()
+        return self
+
+    def get_pain_dataframe(self):
+        """
+        Convert the cohort pain history to a single long-format pandas DataFrame
+
+        Returns:
+            pandas.DataFrame: Same columns as patientPainGenerator.get_pain_dataframe, patients stacked in order
+        """
+        import pandas as pd
+
+        n, days = self.n_patients, self.day
+        df = pd.DataFrame({
+            'day': np.tile(np.arange(days), n),
+            'pain_score': self.pain_history[:, :days].ravel(),
+            'patient_id': np.repeat(self.ids, days),
+            'das_score': (np.repeat(self.das_scores, days) if self.das_history is None
+                          else self.das_history[:, :days].ravel()),
+        })
+
+        # Treatment starts, shifted back by onset days as in the per-patient export
+        started = _treatment_start_matrix(
+            (self.events[:, :days] & ~np.uint8(FLARE_EVENT)).ravel(),
+            df['day'].values,
+            self.registry
+        )
+        for code, treatment in enumerate(self.treatment_types):
+            df[f"started_{treatment}"] = started[:, code]
+
+        return df
@@ -0,0 +1,263 @@
+import json
+import os
+
+import numpy as np
+
+from cohort_generation import TriangularDAS
+from cohort_writer import _write_chunks
+from treatment_determination import TreatmentRegistry, TREATMENT_REGISTRY
+
+STORE_FORMAT_VERSION = 1
+ID_DTYPE = "U16" # fixed width so the ids can be memory-mapped too
+
+class StoredPatient:
+    '''Read-only view of one patient in a CohortStore, usable where a simulated patient is expected'''
+    __slots__ = ('id', 'das_score', 'pain', 'events', 'das_history', 'registry')
+
+    def __init__(self, id, das_score, pain, events, das_history, registry):
+        self.id = id
+        self.das_score = das_score
+        self.pain = pain # memory-mapped rows, only paged in when read
+        self.events = events
+        self.das_history = das_history
+        self.registry = registry
+
+    @property
+    def days(self):
+        """Number of stored days, including day 0"""
+        return len(self.pain)
+
+    def simulate(self, days, *args, **kwargs):
+        """Stored patients cannot be extended, the stored days are all there is"""
+        return self
+
+    def get_pain_dataframe(self):
+        """Same DataFrame as patientPainGenerator.get_pain_dataframe, built from the stored slices"""
+        from patientclass import patientPainGenerator
+        return patientPainGenerator.get_pain_dataframe(self)
+
+class CohortStore:
+    '''
+    On-disk cohort of (patients x days) memory-mapped arrays
+
+    Directory layout:
+        meta.json        sizes, treatment profiles and generation settings
+        pain.npy         float32 pain per patient per day
+        events.npy       uint8 event code per patient per day (as patientPainGenerator.events)
+        das_scores.npy   float64 DAS score at day 0 per patient
+        ids.npy          patient ids
+        das_history.npy  float64 DAS score per patient per day, only for dynamic DAS cohorts
+
+    Opening a store only reads meta.json and maps the arrays, rows are paged
+    in by the OS when read. Every process opening the same store shares the
+    page cache, so app sessions and workers read it without copies.
+    '''
+    def __init__(self, path, metadata, arrays, writable=False):
+        self.path = path
+        self.metadata = metadata
+        self.n_patients = metadata['n_patients']
+        self.days = metadata['days']
+        self.registry = TreatmentRegistry({name: tuple(profile) for name, profile in metadata['treatments'].items()})
+        self.treatment_types = self.registry.types
+        self.pain = arrays['pain']
+        self.events = arrays['events']
+        self.das_scores = arrays['das_scores']
+        self.ids = arrays['ids']
+        self.das_history = arrays.get('das_history')
+        self.writable = writable
+        self._labels = None
+
+    @classmethod
+    def create(cls, path, n_patients, days, registry=None, dynamic_das=False, **metadata):
+        """
+        Create an empty store to be filled with write
+
+        Args:
+            path: Store directory, created if missing (existing arrays are overwritten)
+            n_patients: Number of patients
+            days: Days per patient (including day 0)
+            registry: TreatmentRegistry of the cohort (default TREATMENT_REGISTRY)
+            dynamic_das: Also keep the per-day DAS trajectory
+            **metadata: Extra JSON-serialisable settings to record (seed, noise, DAS sampler, engine, ...)
+
+        Returns:
+            CohortStore: Writable store
+        """
+        from numpy.lib.format import open_memmap
+
+        registry = registry if registry is not None else TREATMENT_REGISTRY
+        os.makedirs(path, exist_ok=True)
+        metadata = {
+            'format_version': STORE_FORMAT_VERSION,
+            'n_patients': n_patients,
+            'days': days,
+            'dynamic_das': dynamic_das,
+            'patients_written': 0,
+            'treatments': {name: list(registry[name]) for name in registry},
+            **metadata,
+        }
+
+        def array(name, shape, dtype):
+            return open_memmap(os.path.join(path, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+        arrays = {
+            'pain': array('pain', (n_patients, days), np.float32),
+            'events': array('events', (n_patients, days), np.uint8),
+            'das_scores': array('das_scores', (n_patients,), np.float64),
+            'ids': array('ids', (n_patients,), ID_DTYPE),
+        }
+        if dynamic_das:
+            arrays['das_history'] = array('das_history', (n_patients, days), np.float64)
+
+        store = cls(path, metadata, arrays, writable=True)
+        store._write_metadata()
+        return store
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """
+        Open an existing store by memory-mapping its arrays
+
+        Args:
+            path: Store directory
+            mode: "r" for read-only (safe to share between processes) or "r+" to write into it
+
+        Returns:
+            CohortStore: The store, no patient data is read until it is accessed
+        """
+        with open(os.path.join(path, "meta.json")) as f:
+            metadata = json.load(f)
+        if metadata.get('format_version') != STORE_FORMAT_VERSION:
+            raise ValueError(f"Unsupported cohort store version: {metadata.get('format_version')}")
+
+        names = ['pain', 'events', 'das_scores', 'ids'] + (['das_history'] if metadata['dynamic_das'] else [])
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in names}
+        return cls(path, metadata, arrays, writable=mode != "r")
+
+    def _write_metadata(self):
+        # Write to a temporary file first so readers never see a half-written meta.json
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(self.metadata, f, indent=2)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def write(self, start, cohort):
+        """
+        Write a chunk of patients into rows start.. of the store
+
+        Args:
+            start: Row of the first patient of the chunk
+            cohort: CohortSimulator or a list of patientPainGenerator objects, each with at least days days
+
+        Returns:
+            int: Number of patients written
+        """
+        if not self.writable:
+            raise ValueError("Store is opened read-only")
+
+        days = self.days
+        if hasattr(cohort, "pain_history"):
+            rows = slice(start, start + cohort.n_patients)
+            self.pain[rows] = cohort.pain_history[:, :days]
+            self.events[rows] = cohort.events[:, :days]
+            self.das_scores[rows] = cohort.das_scores
+            self.ids[rows] = cohort.ids
+            if self.das_history is not None:
+                self.das_history[rows] = (cohort.das_history[:, :days] if cohort.das_history is not None
+                                          else cohort.das_scores[:, None])
+            written = cohort.n_patients
+        else:
+            patients = list(cohort)
+            for row, patient in enumerate(patients, start):
+                self.pain[row] = patient.pain[:days]
+                self.events[row] = patient.events[:days]
+                self.das_scores[row] = patient.das_score
+                self.ids[row] = patient.id
+                if self.das_history is not None:
+                    self.das_history[row] = (patient.das_history[:days] if patient.das_history is not None
+                                             else patient.das_score)
+            written = len(patients)
+
+        self.metadata['patients_written'] = max(self.metadata['patients_written'], start + written)
+        return written
+
+    write_chunk = write # sink interface of cohort_writer._write_chunks
+
+    def flush(self):
+        """
+        Flush the written rows and the metadata to disk
+        """
+        for array in (self.pain, self.events, self.das_scores, self.ids, self.das_history):
+            if array is not None:
+                array.flush()
+        self._write_metadata()
+
+    def __len__(self):
+        return self.n_patients
+
+    def patient(self, index):
+        """
+        View of one patient, only its rows are paged in when used
+
+        Args:
+            index: Zero based patient row
+
+        Returns:
+            StoredPatient: The patient's pain, events and DAS slices
+        """
+        das_history = self.das_history[index] if self.das_history is not None else None
+        return StoredPatient(str(self.ids[index]), float(self.das_scores[index]), self.pain[index],
+                             self.events[index], das_history, self.registry)
+
+    def labels(self):
+        """
+        Dropdown labels of every patient
+
+        Returns:
+            dict: Patient row (as a string) -> "Patient <id> (DAS: x.x)", built once per store
+        """
+        if self._labels is None:
+            self._labels = {
+                str(index): f"Patient {patient_id} (DAS: {das_score:.1f})"
+                for index, (patient_id, das_score) in enumerate(zip(self.ids.tolist(), self.das_scores.tolist()))
+            }
+        return self._labels
+
+    def __repr__(self):
+        return f"CohortStore({self.path!r}, n_patients={self.n_patients}, days={self.days})"
+
+def build_cohort_store(path, n, das_sampler=None, noise=1.2, seed=None, workers=1, chunk_size=1000,
+                       days=1000, engine="reference", dynamic_das=False, progress=None):
+    """
+    Generate a cohort chunk by chunk straight into a new CohortStore
+
+    Args:
+        path: Store directory
+        n: Number of patients to generate
+        das_sampler: Callable taking a numpy Generator and returning a DAS score
+        noise: Noise amplitude for every patient
+        seed: Master seed of the cohort (None for fresh entropy, recorded in the metadata)
+        workers: Number of worker processes, None uses every core
+        chunk_size: Number of patients simulated and written per chunk
+        days: Simulation horizon per patient (including day 0)
+        engine: "reference" (patientPainGenerator per patient) or "vectorised" (CohortSimulator per chunk)
+        dynamic_das: True to let DMARDs and flares change each patient's DAS score during the run
+        progress: Optional callable taking (store, patients_written) after each chunk
+
+    Returns:
+        CohortStore: The filled store, opened read-only
+    """
+    if das_sampler is None:
+        das_sampler = TriangularDAS()
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+
+    def open_store():
+        return CohortStore.create(path, n, days, dynamic_das=dynamic_das, seed=seed, noise=noise,
+                                  das_sampler=repr(das_sampler), engine=engine)
+
+    store = _write_chunks(open_store, n, das_sampler, noise, seed, workers, chunk_size, days, engine,
+                          dynamic_das, progress)
+    store.flush()
+    del store # close the writable maps
+    return CohortStore.open(path)
@@ -0,0 +1,129 @@
+import glob
+import importlib.util
+import os
+
+from cohort_generation import iter_cohort_chunks, iter_vectorised_chunks
+
+ENGINES = ("reference", "vectorised")
+
+class CohortWriter:
+    '''Streams cohort data to disk chunk by chunk: a Parquet dataset directory or a single CSV file'''
+    def __init__(self, path, file_format="auto"):
+        """
+        Args:
+            path: Output directory (parquet, earlier part files are removed) or file (csv, overwritten)
+            file_format: "parquet", "csv" or "auto" (parquet when pyarrow is installed, csv otherwise)
+        """
+        if file_format == "auto":
+            file_format = "parquet" if importlib.util.find_spec("pyarrow") is not None else "csv"
+        if file_format not in ("parquet", "csv"):
+            raise ValueError(f"Unknown file format: {file_format}")
+        if file_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+            raise ImportError("Writing parquet requires pyarrow, install it or use file_format='csv'")
+
+        self.path = path
+        self.file_format = file_format
+        self.chunks_written = 0
+        self.rows_written = 0
+
+        if file_format == "parquet":
+            os.makedirs(path, exist_ok=True)
+            # Overwrite like the CSV output, parts left from an earlier run would mix two cohorts
+            for old_part in glob.glob(os.path.join(glob.escape(path), "part-*.parquet")):
+                os.remove(old_part)
+        elif os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(self, df):
+        """
+        Append one chunk of rows to the output
+
+        Args:
+            df: pandas.DataFrame chunk, every chunk must have the same columns
+        """
+        if self.file_format == "parquet":
+            part_path = os.path.join(self.path, f"part-{self.chunks_written:05d}.parquet")
+            df.to_parquet(part_path, index=False)
+        else:
+            # Header only on the first chunk, later chunks are appended
+            df.to_csv(self.path, mode="w" if self.chunks_written == 0 else "a",
+                      header=self.chunks_written == 0, index=False)
+        self.chunks_written += 1
+        self.rows_written += len(df)
+
+    def write_chunk(self, start, chunk):
+        """
+        Append one simulated chunk of patients as rows
+
+        Args:
+            start: Index of the chunk's first patient (unused, rows are appended in order)
+            chunk: List of patientPainGenerator objects or a CohortSimulator
+
+        Returns:
+            int: Number of patients written
+        """
+        from patientclass import cohort_pain_dataframe
+
+        if hasattr(chunk, "pain_history"):
+            self.write(chunk.get_pain_dataframe())
+            return chunk.n_patients
+        self.write(cohort_pain_dataframe(chunk))
+        return len(chunk)
+
+def _write_chunks(open_sink, n, das_sampler, noise, seed, workers, chunk_size, days, engine, dynamic_das,
+                  progress):
+    """
+    Simulate a cohort chunk by chunk, handing each chunk to a sink before the next one is simulated
+
+    Memory use depends on chunk_size, not on the cohort size. With the
+    reference engine the patients are the same as generate_cohort gives for
+    the same arguments.
+
+    Args:
+        open_sink: Callable returning the sink (CohortWriter or CohortStore), only called once the
+            arguments are checked so a bad call leaves earlier output alone. Its write_chunk(start, chunk)
+            gets a list of patientPainGenerator objects (reference) or a CohortSimulator (vectorised)
+        progress: Optional callable taking (sink, patients_written) after each chunk
+        Other arguments as in write_cohort
+
+    Returns:
+        The sink, after its last chunk
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine}")
+
+    sink = open_sink()
+    iter_chunks = iter_cohort_chunks if engine == "reference" else iter_vectorised_chunks
+    patients_written = 0
+    for chunk in iter_chunks(n, chunk_size, das_sampler, noise, seed, workers, days=days, dynamic_das=dynamic_das):
+        patients_written += sink.write_chunk(patients_written, chunk)
+        del chunk # free the chunk before the next one is simulated
+        if progress is not None:
+            progress(sink, patients_written)
+    return sink
+
+def write_cohort(path, n, das_sampler=None, noise=1.2, seed=None, workers=1,
+                 chunk_size=1000, file_format="auto", days=1000, engine="reference", progress=None,
+                 dynamic_das=False):
+    """
+    Generate a cohort in chunks and stream each chunk to disk before the next one is simulated
+
+    Args:
+        path: Output directory (parquet) or file (csv)
+        n: Number of patients to generate
+        das_sampler: Callable taking a numpy Generator and returning a DAS score
+        noise: Noise amplitude for every patient
+        seed: Master seed of the cohort
+        workers: Number of worker processes, None uses every core
+        chunk_size: Number of patients simulated and written per chunk
+        file_format: "parquet", "csv" or "auto"
+        days: Simulation horizon per patient (including day 0)
+        engine: "reference" (patientPainGenerator per patient) or "vectorised" (CohortSimulator per chunk)
+        progress: Optional callable taking (writer, patients_written) after each chunk
+        dynamic_das: True to let DMARDs and flares change each patient's DAS score during the run
+
+    Returns:
+        CohortWriter: The writer used, with chunks_written and rows_written filled in
+    """
+    return _write_chunks(lambda: CohortWriter(path, file_format), n, das_sampler, noise, seed, workers,
+                         chunk_size, days, engine, dynamic_das, progress)
@@ -0,0 +1,341 @@
+import importlib.util
+
+import numpy as np
+
+from das_score_changes import MIN_DAS_SCORE, MAX_DAS_SCORE, DMARD_DAS_INTERVAL, DMARD_DAS_FACTOR, FLARE_DAS_FACTOR
+from flare_determination import FLARE_PAIN_SCORE, FLARE_EVENT, BASELINE_FLARE_CHANCE, FLARE_CONTINUE_THRESHOLD
+from treatment_determination import (
+    CHRONIC_MILD_PAIN,
+    DMARD_ESCALATION_COUNT,
+    FULL_WINDOW_DAYS,
+    PERSISTENT_PAIN,
+    RESPONSE_DECLINE_CHANCE,
+    RESPONSE_DECLINE_MIN,
+    RESPONSE_FLOOR,
+    RESPONSE_REDUCTION_RANGE,
+    SEVERE_PAIN,
+    SIGNIFICANT_PAIN,
+)
+
+BACKENDS = ("python", "numba", "auto")
+DECISION_TREATMENTS = ("emergency_steroid", "nsaid", "dmard", "biologic", "physical_therapy")
+DAS_CONSTANTS = (float(MIN_DAS_SCORE), float(MAX_DAS_SCORE), int(DMARD_DAS_INTERVAL), float(DMARD_DAS_FACTOR),
+                 float(FLARE_DAS_FACTOR)) # passed to the kernel, not compiled in
+FLARE_CONSTANTS = (float(BASELINE_FLARE_CHANCE), float(FLARE_CONTINUE_THRESHOLD))
+DECISION_CONSTANTS = (float(SEVERE_PAIN), float(SIGNIFICANT_PAIN), float(PERSISTENT_PAIN), float(CHRONIC_MILD_PAIN[0]),
+                      float(CHRONIC_MILD_PAIN[1]), int(DMARD_ESCALATION_COUNT), int(FULL_WINDOW_DAYS))
+DECLINE_CONSTANTS = (float(RESPONSE_DECLINE_CHANCE), float(RESPONSE_DECLINE_MIN), float(RESPONSE_REDUCTION_RANGE[0]),
+                     float(RESPONSE_REDUCTION_RANGE[1]), float(RESPONSE_FLOOR))
+
+# Kernel stop reasons
+FINISHED = 0
+OUT_OF_DRAWS = 1 # the pre-drawn normals or uniforms ran out, refill and continue
+PROLONGED_FLARE = 2 # a flare that extends needs a duration draw, the day goes through the Python loop
+
+_compiled_kernel = None
+
+def numba_available():
+    return importlib.util.find_spec("numba") is not None
+
+def _resolve_backend(backend):
+    """
+    Map the backend argument to "python" or "numba"
+
+    Raises:
+        ValueError: Unknown backend
+        ImportError: backend="numba" without numba installed
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown simulation backend: {backend}")
+    if backend == "auto":
+        return "numba" if numba_available() else "python"
+    if backend == "numba" and not numba_available():
+        raise ImportError("The numba backend requires numba, install it or use backend='auto' to fall back to Python")
+    return backend
+
+def _peek_uniforms(rng, count):
+    """
+    Draw count uniforms from a Generator and rewind it, so the same values are drawn again later
+    """
+    bit_generator = rng.bit_generator
+    state = bit_generator.state
+    values = np.random.Generator(bit_generator).random(count)
+    bit_generator.state = state
+    return values
+
+def _day_loop(start, end, pain, events, das_history, random_factors, flare_draws, draw_offset, noise_amplitude,
+              max_effect, onset_days, duration_days, variability, declines, decision_codes,
+              order, days_used, responses, window, float_state, int_state,
+              normals, normal_position, uniforms, uniform_position, dynamic_das, das_constants,
+              flare_constants, decision_constants, decline_constants):
+    """
+    The patient day loop over typed arrays, compiled with numba.njit (same steps and float operations as _run_days)
+
+    State arrays are updated in place:
+        order: Active treatment codes in start order, int_state[4] of them in use
+        days_used: Days on treatment per code, -1 when not on it
+        responses: Response factor per code
+        window: Ring buffer of the 7-day pain window
+        float_state: [last pain, window running sum, DAS score, flare chance, flare pain level]
+        int_state: [window push count, active flare, flare days remaining, DMARD counter, active treatments]
+
+    das_constants, flare_constants, decision_constants and decline_constants are DAS_CONSTANTS,
+    FLARE_CONSTANTS, DECISION_CONSTANTS and DECLINE_CONSTANTS, the das_score_changes,
+    flare_determination and treatment_determination rules the kernel applies (passed in so they cannot drift).
+
+    Returns:
+        tuple: (day, reason, normals used, uniforms used) - the loop stops before day for the given reason
+    """
+    steroid, nsaid, dmard, biologic, physical_therapy = decision_codes
+    min_das, max_das, dmard_das_interval, dmard_das_factor, flare_das_factor = das_constants
+    baseline_flare_chance, flare_continue_threshold = flare_constants
+    severe_pain, significant_pain, persistent_pain, chronic_mild_low, chronic_mild_high, escalation_count, \
+        full_window_days = decision_constants
+    decline_chance, decline_min, reduction_low, reduction_high, response_floor = decline_constants
+    window_size = window.shape[0]
+    n_types = max_effect.shape[0]
+
+    previous_pain = float_state[0]
+    running_sum = float_state[1]
+    das_score = float_state[2]
+    flare_chance = float_state[3]
+    flare_pain_level = float_state[4]
+    count = int_state[0]
+    active_flare = int_state[1]
+    flare_days_remaining = int_state[2]
+    dmard_counter = int_state[3]
+    n_active = int_state[4]
+    normals_start = normal_position
+    uniforms_start = uniform_position
+
+    day = start
+    reason = FINISHED
+    while day < end:
+        # Stop before the day if it could run out of draws (one normal per treatment, two uniforms per decline check)
+        if normals.shape[0] - normal_position < n_active + 1 or uniforms.shape[0] - uniform_position < 2 * n_types:
+            reason = OUT_OF_DRAWS
+            break
+        random_factor = random_factors[day - draw_offset]
+        flare = flare_draws[day - draw_offset] < flare_chance
+        if flare and flare_chance > flare_continue_threshold:
+            reason = PROLONGED_FLARE
+            break
+
+        #------------- FLARE MODULE -------------#
+        if active_flare and flare_days_remaining > 0:
+            new_pain = flare_pain_level
+            flare_days_remaining -= 1
+            if flare_days_remaining == 0:
+                active_flare = 0
+        if flare:
+            events[day] |= FLARE_EVENT
+            new_pain = previous_pain + (noise_amplitude * random_factor) + FLARE_PAIN_SCORE
+        else:
+            new_pain = previous_pain + (noise_amplitude * random_factor)
+
+        #------------- TREATMENT MODULE -------------#
+        if day > 7:
+            window_days = min(count, window_size)
+            avg_pain = running_sum / window_days
+            max_pain = window[0]
+            for slot in range(1, window_days):
+                max_pain = max(max_pain, window[slot])
+            new_treatment = -1
+            if max_pain >= severe_pain:
+                new_treatment = steroid
+            elif max_pain >= significant_pain:
+                new_treatment = nsaid
+            elif avg_pain >= persistent_pain and window_days >= full_window_days:
+                new_treatment = biologic if dmard_counter >= escalation_count else dmard
+            elif chronic_mild_low <= avg_pain < chronic_mild_high and window_days >= full_window_days:
+                new_treatment = physical_therapy
+
+            if new_treatment >= 0 and days_used[new_treatment] < 0:
+                days_used[new_treatment] = 0
+                order[n_active] = new_treatment
+                n_active += 1
+                events[day] |= new_treatment + 1
+                if new_treatment == dmard:
+                    dmard_counter += 1
+
+        # Treatment effects in start order, expired treatments are dropped from the order as we go
+        treatment_effect = 0.0
+        kept = 0
+        for position in range(n_active):
+            code = order[position]
+            used = days_used[code]
+            standard_normal = normals[normal_position]
+            normal_position += 1
+            effect_strength = min(used / onset_days[code], 1.0)
+            effect_strength *= max(0.1, min(1.0 + variability[code] * standard_normal, 1.5))
+            effect = max_effect[code] * effect_strength
+
+            if used >= duration_days[code]:
+                days_used[code] = -1
+            else:
+                days_used[code] = used + 1
+                order[kept] = code
+                kept += 1
+            if declines[code]:
+                chance = uniforms[uniform_position]
+                uniform_position += 1
+                if chance < decline_chance and responses[code] > decline_min:
+                    # Generator.uniform(low, high) as low + (high - low) * random()
+                    reduction = reduction_low + (reduction_high - reduction_low) * uniforms[uniform_position]
+                    uniform_position += 1
+                    responses[code] = max(response_floor, responses[code] - reduction)
+            if used >= onset_days[code]:
+                treatment_effect += effect
+        n_active = kept
+
+        new_pain += treatment_effect
+        new_pain = min(10.0, max(1.0, new_pain))
+        pain[day] = new_pain
+
+        # PainWindow.push: the running sum is re-anchored once per window
+        slot = count % window_size
+        if count >= window_size:
+            running_sum -= window[slot]
+        window[slot] = new_pain
+        count += 1
+        if slot == window_size - 1:
+            running_sum = 0.0
+            for value in window:
+                running_sum += value
+        else:
+            running_sum += new_pain
+        previous_pain = new_pain
+
+        #------------- DAS SCORE MODULE -------------#
+        if dynamic_das:
+            new_das = das_score
+            days_on_dmard = days_used[dmard]
+            if days_on_dmard > 0 and days_on_dmard % dmard_das_interval == 0:
+                new_das = max(min(new_das, min_das), new_das * dmard_das_factor)
+            if flare:
+                new_das = min(max_das, new_das * flare_das_factor)
+            if new_das != das_score:
+                das_score = new_das
+                flare_chance = baseline_flare_chance * (1 + (das_score / 2))
+            das_history[day] = das_score
+        day += 1
+
+    float_state[0] = previous_pain
+    float_state[1] = running_sum
+    float_state[2] = das_score
+    float_state[3] = flare_chance
+    float_state[4] = flare_pain_level
+    int_state[0] = count
+    int_state[1] = active_flare
+    int_state[2] = flare_days_remaining
+    int_state[3] = dmard_counter
+    int_state[4] = n_active
+    return day, reason, normal_position - normals_start, uniform_position - uniforms_start
+
+def _get_kernel():
+    """
+    Compile the day loop on first use (cached on disk by numba between runs)
+    """
+    global _compiled_kernel
+    if _compiled_kernel is None:
+        from numba import njit
+        _compiled_kernel = njit(cache=True)(_day_loop)
+    return _compiled_kernel
+
+def _simulate_compiled(patient, start, end, random_factors, flare_draws, rng, treatment_noise,
+                       profiler=None, stage_start=None):
+    """
+    Run the patient from start to end (exclusive) with the compiled day loop
+
+    Random numbers come from the same streams and in the same order as the
+    Python day loop: the treatment normals and the decline uniforms are
+    peeked in bulk and only the ones the kernel used are taken. The output
+    is identical to backend="python". The rare prolonged flare (a duration
+    draw from the patient generator) runs through the Python day loop.
+
+    Args:
+        patient: patientPainGenerator with its arrays already grown to end
+        start: First day to simulate
+        end: Day to stop before
+        random_factors: Pre-drawn noise steps for days start..end-1
+        flare_draws: Pre-drawn uniform(0.2, 0.75) flare values for days start..end-1
+        rng: Generator for the flare duration and response decline draws
+        treatment_noise: NormalBatch for the treatment response variation
+        profiler: Optional SimulationProfiler, kernel runs are timed as 'compiled_loop'
+        stage_start: Start time of the current profiler stage
+
+    Returns:
+        float or None: Start time of the next profiler stage
+    """
+    from flare_determination import _adjusted_flare_chance
+
+    kernel = _get_kernel()
+    registry = patient.registry
+    treatment_types = registry.types
+    treatment_codes = {treatment: code for code, treatment in enumerate(treatment_types)}
+    if not all(treatment in treatment_codes for treatment in DECISION_TREATMENTS):
+        # The decisions name these treatments, a registry without them only works in the Python loop
+        return patient._run_days(start, end, random_factors, flare_draws, start, rng, treatment_noise,
+                                 profiler, stage_start)
+
+    profiles = np.array([tuple(registry[t]) for t in treatment_types], dtype=float).reshape(-1, 4)
+    max_effect, onset_days, duration_days, variability = (np.ascontiguousarray(column) for column in profiles.T)
+    declines = np.array([t in ("dmard", "biologic") for t in treatment_types])
+    decision_codes = tuple(treatment_codes[t] for t in DECISION_TREATMENTS)
+    random_factors = np.ascontiguousarray(random_factors, dtype=np.float64)
+    das_history = patient.das_history if patient.das_history is not None else np.empty(0) # only written when dynamic
+    flare_draws = np.ascontiguousarray(flare_draws, dtype=np.float64)
+
+    day = start
+    while day < end:
+        # Unpack the saved state into typed arrays
+        names = list(patient._treatments)
+        order = np.zeros(len(treatment_types), dtype=np.int64)
+        order[:len(names)] = [treatment_codes[name] for name in names]
+        days_used = np.full(len(treatment_types), -1, dtype=np.int64)
+        for name, used in patient._treatments.items():
+            days_used[treatment_codes[name]] = used
+        responses = np.array(patient.treatment_responses, dtype=np.float64)
+        window = patient._recent_pain
+        ring = np.array(window._values, dtype=np.float64)
+        active_flare, flare_days_remaining, flare_pain_level = patient._flare_state
+        float_state = np.array([patient._last_pain, window._sum, patient._das, _adjusted_flare_chance(patient._das),
+                                np.nan if flare_pain_level is None else flare_pain_level])
+        int_state = np.array([window._count, int(active_flare), flare_days_remaining, patient._dmard_counter, len(names)],
+                             dtype=np.int64)
+
+        # Enough draws for about two active treatments a day, the kernel stops early if they run out
+        remaining = end - day
+        normals = treatment_noise.peek(2 * remaining + len(treatment_types) + 1)
+        uniforms = _peek_uniforms(rng, 2 * remaining + 2 * len(treatment_types))
+
+        day, reason, normals_used, uniforms_used = kernel(
+            day, end, patient.pain, patient.events, das_history, random_factors, flare_draws, start,
+            float(patient.noise_amplitude), max_effect, onset_days, duration_days, variability, declines,
+            decision_codes, order, days_used, responses, ring, float_state, int_state,
+            normals, 0, uniforms, 0, bool(patient.dynamic_das), DAS_CONSTANTS,
+            FLARE_CONSTANTS, DECISION_CONSTANTS, DECLINE_CONSTANTS)
+
+        # Take the draws the kernel used and save the state back
+        treatment_noise.skip(int(normals_used))
+        if uniforms_used:
+            rng.random(int(uniforms_used))
+        patient._treatments = {treatment_types[code]: int(days_used[code]) for code in order[:int_state[4]].tolist()}
+        patient.treatment_responses = responses
+        window._restore(ring.tolist(), int(int_state[0]), float(float_state[1]))
+        patient._last_pain = float(float_state[0])
+        patient._das = float(float_state[2])
+        patient._flare_state = (bool(int_state[1]), int(int_state[2]),
+                                None if np.isnan(float_state[4]) else float(float_state[4]))
+        patient._dmard_counter = int(int_state[3])
+
+        if profiler is not None:
+            stage_start = profiler.lap('compiled_loop', stage_start)
+
+        if reason == PROLONGED_FLARE:
+            stage_start = patient._run_days(day, day + 1, random_factors, flare_draws, start, rng, treatment_noise,
+                                            profiler, stage_start)
+            day += 1
+
+    patient.treatment_days = np.array([patient._treatments.get(t, -1) for t in treatment_types], dtype=np.int32)
+    return stage_start
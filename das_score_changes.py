@@ -1,14 +1,54 @@
+import numpy as np
+
+MAX_DAS_SCORE = 10 # Upper bound of the DAS scale, flares cannot push the score past it
+MIN_DAS_SCORE = 2.6 # Remission threshold, DMARDs cannot bring the score below it
+DMARD_DAS_INTERVAL = 30 # Days on a DMARD between DAS reductions (a monthly step)
+DMARD_DAS_FACTOR = 0.9 # DAS multiplier of each monthly DMARD step
+FLARE_DAS_FACTOR = 1.1 # DAS multiplier on the first day of a flare
+
+def _dmard_das_step(das_score):
+    # Monthly step towards remission, a score already below the floor is left as it is
+    return max(min(das_score, MIN_DAS_SCORE), das_score * DMARD_DAS_FACTOR)
+
 def _reduce_das_on_dmard(current_treatments, das_score):
-    if 'dmard' in current_treatments:
-        das_score = das_score * 0.9
+    days_on_dmard = current_treatments.get('dmard', 0)
+    if days_on_dmard > 0 and days_on_dmard % DMARD_DAS_INTERVAL == 0:
+        das_score = _dmard_das_step(das_score)
         return das_score
     else:
         return das_score
 
 def _increase_das_on_flare(flare_time, das_score):
     if flare_time == 1:
-        das_score = das_score * 1.1
+        das_score = min(MAX_DAS_SCORE, das_score * FLARE_DAS_FACTOR)
         return das_score
     else:
         return das_score
 
+def _reduce_das_on_dmard_array(days_on_dmard, das_scores):
+    """
+    Vectorised version of _reduce_das_on_dmard for a whole cohort
+
+    Args:
+        days_on_dmard: Array of days on a DMARD at the end of the day, -1 for patients not on one
+        das_scores: Array of DAS scores, one per patient
+
+    Returns:
+        numpy.ndarray: The new DAS scores
+    """
+    reduce = (days_on_dmard > 0) & (days_on_dmard % DMARD_DAS_INTERVAL == 0)
+    reduced = np.maximum(np.minimum(das_scores, MIN_DAS_SCORE), das_scores * DMARD_DAS_FACTOR)
+    return np.where(reduce, reduced, das_scores)
+
+def _increase_das_on_flare_array(flare, das_scores):
+    """
+    Vectorised version of _increase_das_on_flare for a whole cohort
+
+    Args:
+        flare: Boolean array, True for patients that flared today
+        das_scores: Array of DAS scores, one per patient
+
+    Returns:
+        numpy.ndarray: The new DAS scores
+    """
+    return np.where(flare, np.minimum(MAX_DAS_SCORE, das_scores * FLARE_DAS_FACTOR), das_scores)
@@ -0,0 +1,273 @@
+import argparse
+import math
+import sys
+
+import numpy as np
+
+from cohort_analytics import _stacked_arrays, _first_treatment_days
+from flare_determination import FLARE_EVENT
+
+ENGINES = {} # name -> callable(n, seed, days, dynamic_das) returning (pain, events, treatment_types)
+
+# A check passes when its effect size is within tolerance or the difference is not significant at alpha
+DEFAULT_TOLERANCES = {
+    'pain_histogram': 0.02,      # total variation distance between the pooled pain histograms
+    'mean_pain': 0.05,           # KS statistic of the per-patient mean pain
+    'flare_rate': 0.05,          # KS statistic of the per-patient flare rate
+    'pooled_flare_rate': 0.1,    # relative difference of the pooled flare rate
+    'start_count': 0.1,          # relative difference of the mean starts per patient, per treatment
+    'fraction_started': 0.03,    # absolute difference of the fraction of patients who started, per treatment
+    'time_to_first': 0.1,        # KS statistic of the first start day of the patients who started, per treatment
+}
+DEFAULT_ALPHA = 0.01
+PAIN_BINS = np.linspace(1, 10, 19) # half-point bins over the 1 - 10 scale
+
+def engine(name):
+    """
+    Register an engine: the decorated function simulates a cohort and returns its stacked arrays
+    """
+    def register(simulate):
+        ENGINES[name] = simulate
+        return simulate
+    return register
+
+#------------- ENGINES -------------#
+
+def _patient_engine(n, seed, days, dynamic_das, **patient_kwargs):
+    from patientclass import patientPainGenerator
+    from cohort_generation import _cohort_patient_args
+
+    patients = [
+        patientPainGenerator(patient_id, das_score, seed=simulation_seed, noise_amplitude=noise, days=days,
+                             dynamic_das=dynamic_das, **patient_kwargs)
+        for patient_id, das_score, simulation_seed, noise, _, _, _ in _cohort_patient_args(n, None, 1.2, seed, 0, days)
+    ]
+    return _stacked_arrays(patients)
+
+@engine("reference")
+def _reference(n, seed, days, dynamic_das):
+    return _patient_engine(n, seed, days, dynamic_das)
+
+@engine("numba")
+def _numba(n, seed, days, dynamic_das):
+    return _patient_engine(n, seed, days, dynamic_das, backend="numba")
+
+@engine("vectorised")
+def _vectorised(n, seed, days, dynamic_das):
+    from cohort_generation import iter_vectorised_chunks
+
+    pain, events = [], []
+    for chunk in iter_vectorised_chunks(n, 1000, seed=seed, days=days, dynamic_das=dynamic_das):
+        chunk_pain, chunk_events, treatment_types = _stacked_arrays(chunk)
+        pain.append(chunk_pain)
+        events.append(chunk_events)
+    return np.concatenate(pain), np.concatenate(events), treatment_types
+
+#------------- STATISTICS -------------#
+
+def _ks_2samp(a, b):
+    """
+    Two-sample Kolmogorov-Smirnov test with the asymptotic p-value
+
+    Returns:
+        tuple: (statistic, p_value), (nan, nan) when a sample is empty
+    """
+    a, b = np.sort(a), np.sort(b)
+    if not len(a) or not len(b):
+        return np.nan, np.nan
+    values = np.concatenate([a, b])
+    statistic = float(np.max(np.abs(np.searchsorted(a, values, side='right') / len(a)
+                                    - np.searchsorted(b, values, side='right') / len(b))))
+
+    # Kolmogorov distribution with Stephens' small sample correction
+    en = math.sqrt(len(a) * len(b) / (len(a) + len(b)))
+    lam = (en + 0.12 + 0.11 / en) * statistic
+    if lam < 1e-3:
+        return statistic, 1.0
+    p_value = 2 * sum((-1) ** (k - 1) * math.exp(-2 * k * k * lam * lam) for k in range(1, 101))
+    return statistic, min(1.0, max(0.0, p_value))
+
+def _two_sided_p(z):
+    return math.erfc(abs(z) / math.sqrt(2))
+
+def _welch_p(a, b):
+    """Two-sided p-value of the difference of two means (normal approximation, fine for cohort sizes)"""
+    se = math.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b)) if len(a) > 1 and len(b) > 1 else 0.0
+    if se == 0:
+        return 1.0 if a.mean() == b.mean() else 0.0
+    return _two_sided_p((a.mean() - b.mean()) / se)
+
+def _proportion_p(successes_a, n_a, successes_b, n_b):
+    """Two-sided p-value of the difference of two proportions (pooled z-test)"""
+    pooled = (successes_a + successes_b) / (n_a + n_b)
+    se = math.sqrt(pooled * (1 - pooled) * (1 / n_a + 1 / n_b))
+    if se == 0:
+        return 1.0
+    return _two_sided_p((successes_a / n_a - successes_b / n_b) / se)
+
+def _relative_difference(reference, candidate):
+    if reference == 0:
+        return 0.0 if candidate == 0 else np.inf
+    return abs(candidate - reference) / abs(reference)
+
+#------------- VALIDATION -------------#
+
+def _outcomes(pain, events, n_treatments):
+    """
+    Per-patient summaries of a cohort compared between engines
+    """
+    codes = events & ~np.uint8(FLARE_EVENT)
+    return {
+        'pain_histogram': np.histogram(pain, bins=PAIN_BINS)[0] / pain.size,
+        'mean_pain': pain.mean(axis=1, dtype=np.float64),
+        'flare_rate': np.count_nonzero(events & np.uint8(FLARE_EVENT), axis=1) / pain.shape[1],
+        'start_counts': np.stack([np.count_nonzero(codes == code + 1, axis=1) for code in range(n_treatments)], axis=1),
+        'first_start': _first_treatment_days(events, n_treatments),
+    }
+
+def compare_cohorts(reference, candidate, treatment_types, tolerances=None, alpha=DEFAULT_ALPHA):
+    """
+    Compare the outcome distributions of two simulated cohorts
+
+    Args:
+        reference: (pain, events) arrays of the reference cohort
+        candidate: (pain, events) arrays of the candidate cohort
+        treatment_types: Treatment names in code order
+        tolerances: Overrides of DEFAULT_TOLERANCES
+        alpha: Significance level, a check also passes when its difference is not significant
+
+    Returns:
+        list: One dict per check with 'check', 'reference', 'candidate', 'statistic', 'p_value', 'tolerance', 'passed'
+    """
+    tolerances = {**DEFAULT_TOLERANCES, **(tolerances or {})}
+    ref = _outcomes(*reference, len(treatment_types))
+    cand = _outcomes(*candidate, len(treatment_types))
+    n_ref, n_cand = len(ref['mean_pain']), len(cand['mean_pain'])
+    checks = []
+
+    def check(name, tolerance_key, reference_value, candidate_value, statistic, p_value):
+        tolerance = tolerances[tolerance_key]
+        passed = bool(statistic <= tolerance or (p_value is not None and p_value >= alpha))
+        checks.append({
+            'check': name,
+            'reference': reference_value,
+            'candidate': candidate_value,
+            'statistic': statistic,
+            'p_value': p_value,
+            'tolerance': tolerance,
+            'passed': passed,
+        })
+
+    # Pooled pain distribution, an effect size only (days within a patient are not independent)
+    total_variation = 0.5 * float(np.abs(ref['pain_histogram'] - cand['pain_histogram']).sum())
+    check('pain_histogram', 'pain_histogram', None, None, total_variation, None)
+
+    for key in ('mean_pain', 'flare_rate'):
+        statistic, p_value = _ks_2samp(ref[key], cand[key])
+        check(key, key, float(ref[key].mean()), float(cand[key].mean()), statistic, p_value)
+
+    ref_flares, cand_flares = ref['flare_rate'].mean(), cand['flare_rate'].mean()
+    check('pooled_flare_rate', 'pooled_flare_rate', float(ref_flares), float(cand_flares),
+          _relative_difference(ref_flares, cand_flares), _welch_p(ref['flare_rate'], cand['flare_rate']))
+
+    for code, treatment in enumerate(treatment_types):
+        ref_counts, cand_counts = ref['start_counts'][:, code], cand['start_counts'][:, code]
+        check(f'start_count[{treatment}]', 'start_count', float(ref_counts.mean()), float(cand_counts.mean()),
+              _relative_difference(ref_counts.mean(), cand_counts.mean()), _welch_p(ref_counts, cand_counts))
+
+        ref_first, cand_first = ref['first_start'][:, code], cand['first_start'][:, code]
+        ref_started, cand_started = ref_first[ref_first >= 0], cand_first[cand_first >= 0]
+        check(f'fraction_started[{treatment}]', 'fraction_started', len(ref_started) / n_ref, len(cand_started) / n_cand,
+              abs(len(ref_started) / n_ref - len(cand_started) / n_cand),
+              _proportion_p(len(ref_started), n_ref, len(cand_started), n_cand))
+
+        if len(ref_started) and len(cand_started):
+            statistic, p_value = _ks_2samp(ref_started, cand_started)
+            check(f'time_to_first[{treatment}]', 'time_to_first', float(np.median(ref_started)),
+                  float(np.median(cand_started)), statistic, p_value)
+
+    return checks
+
+def validate_engine(candidate, reference="reference", n=2000, days=1000, seed=0, candidate_seed=None,
+                    dynamic_das=False, tolerances=None, alpha=DEFAULT_ALPHA):
+    """
+    Run a seeded cohort through the reference and a candidate engine and compare their outcome distributions
+
+    By default the candidate gets a different seed, so an engine that is
+    only statistically equivalent is judged on its distributions rather
+    than on reproducing the reference draws.
+
+    Args:
+        candidate: Name of the engine to validate (see ENGINES)
+        reference: Name of the engine to compare against
+        n: Patients per cohort
+        days: Days per patient (including day 0)
+        seed: Master seed of the reference cohort
+        candidate_seed: Master seed of the candidate cohort (default seed + 1)
+        dynamic_das: Simulate both cohorts with a dynamic DAS score
+        tolerances: Overrides of DEFAULT_TOLERANCES
+        alpha: Significance level of the tests
+
+    Returns:
+        list: Check dicts from compare_cohorts
+    """
+    for name in (candidate, reference):
+        if name not in ENGINES:
+            raise ValueError(f"Unknown engine: {name} (known: {', '.join(ENGINES)})")
+    if candidate_seed is None:
+        candidate_seed = seed + 1
+
+    ref_pain, ref_events, treatment_types = ENGINES[reference](n, seed, days, dynamic_das)
+    cand_pain, cand_events, _ = ENGINES[candidate](n, candidate_seed, days, dynamic_das)
+    return compare_cohorts((ref_pain, ref_events), (cand_pain, cand_events), treatment_types, tolerances, alpha)
+
+def _format_value(value):
+    if value is None:
+        return "-"
+    return f"{value:.4g}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that fast engines reproduce the reference simulator's outcome distributions")
+    parser.add_argument("engines", nargs="*", help=f"Engines to validate (default all but the reference): {', '.join(ENGINES)}")
+    parser.add_argument("--reference", default="reference", help="Engine to compare against")
+    parser.add_argument("-n", "--patients", type=int, default=2000, help="Patients per cohort")
+    parser.add_argument("--days", type=int, default=1000, help="Days per patient (including day 0)")
+    parser.add_argument("--seed", type=int, default=0, help="Master seed of the reference cohort")
+    parser.add_argument("--same-seed", action="store_true",
+                        help="Give the candidate the reference seed (exact engines then match draw for draw)")
+    parser.add_argument("--dynamic-das", action="store_true", help="Simulate with a dynamic DAS score")
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="Significance level of the tests")
+    parser.add_argument("--tolerance", action="append", default=[], metavar="CHECK=VALUE",
+                        help=f"Override a tolerance, checks: {', '.join(DEFAULT_TOLERANCES)}")
+    args = parser.parse_args(argv)
+
+    tolerances = {}
+    for override in args.tolerance:
+        key, _, value = override.partition("=")
+        if key not in DEFAULT_TOLERANCES or not value:
+            parser.error(f"Invalid tolerance override: {override}")
+        tolerances[key] = float(value)
+
+    engines = args.engines or [name for name in ENGINES if name != args.reference]
+    failed = 0
+    for name in engines:
+        if name == "numba":
+            from compiled_simulation import numba_available
+            if not numba_available():
+                print(f"{name}: skipped, numba is not installed")
+                continue
+        checks = validate_engine(name, args.reference, args.patients, args.days, args.seed,
+                                 args.seed if args.same_seed else None, args.dynamic_das, tolerances, args.alpha)
+        engine_failed = sum(not check['passed'] for check in checks)
+        failed += engine_failed
+        print(f"{name} vs {args.reference}: {len(checks) - engine_failed}/{len(checks)} checks passed")
+        for check in checks:
+            print(f"  {'ok  ' if check['passed'] else 'FAIL'} {check['check']:<36} "
+                  f"ref {_format_value(check['reference']):>9}  cand {_format_value(check['candidate']):>9}  "
+                  f"stat {_format_value(check['statistic']):>9} (tol {check['tolerance']:g})  "
+                  f"p {_format_value(check['p_value']):>9}")
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
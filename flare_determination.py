@@ -1,13 +1,30 @@
-import random
 import numpy as np
 
-def _flare_chance(baseline_chance=0.05, disease_activity=None):
+# Flare duration distribution for prolonged flares (days, probability)
+FLARE_DURATIONS = [1, 2, 3, 4, 5, 6]
+FLARE_DURATION_PROBABILITIES = [0.4, 0.3, 0.1, 0.1, 0.05, 0.05]  # Probabilities sum to 1.0
+
+FLARE_PAIN_SCORE = 4 # Pain added on the day a flare starts
+FLARE_EVENT = 0x80 # Bit set in a day's event code when a flare occurs
+BASELINE_FLARE_CHANCE = 0.05 # Flare chance before the disease activity adjustment
+FLARE_CONTINUE_THRESHOLD = 0.5 # Flares with a higher chance than this are prolonged
+
+def _adjusted_flare_chance(disease_activity, baseline_chance=BASELINE_FLARE_CHANCE):
+    """
+    Flare chance for a disease activity score (a scalar or an array), kept by callers until the score changes
+    """
+    return baseline_chance * (1 + (disease_activity / 2))  # Reduced impact
+
+def _flare_chance(baseline_chance=BASELINE_FLARE_CHANCE, disease_activity=None, rng=None, rand_value=None, adjusted_chance=None):
     """
     Calculate chance of flare based on baseline chance and disease activity
     
     Args:
         baseline_chance: Base probability of flare (0-1)
         disease_activity: Patient's disease activity score
+        rng: numpy.random.Generator to draw from (a fresh one if not given)
+        rand_value: Pre-drawn uniform(0.2, 0.75) value for this day, skips the draw
+        adjusted_chance: Chance from _adjusted_flare_chance for disease_activity, skips recomputing it
         
     Returns:
         float or None: Probability of flare if occurs, None otherwise
@@ -15,37 +32,81 @@ def _flare_chance(baseline_chance=0.05, disease_activity=None):
     if disease_activity is None:
         return None
         
-    rand_value = random.uniform(0.2, 0.75)
+    if rand_value is None:
+        if rng is None:
+            rng = np.random.default_rng()
+        rand_value = rng.uniform(0.2, 0.75)
     
     # Adjust flare chance based on disease activity
-    adjusted_chance = baseline_chance * (1 + (disease_activity / 2))  # Reduced impact
+    if adjusted_chance is None:
+        adjusted_chance = _adjusted_flare_chance(disease_activity, baseline_chance)
     
     # Determine if flare occurs
     flare_occurs = rand_value < adjusted_chance
-    # Random Pain increase
-    flare_pain = random.uniform(3,4)
     if flare_occurs:
         return adjusted_chance
     else:
         return None
 
-def _flare_longetivty(adjusted_chance):
+def _flare_longetivty(adjusted_chance, rng=None):
     '''
     Grabs the adjust chance - if the value is greater than threshold then the longevity value is a random interger between 1 and 7 (indicating prolonged flare assuming now longer than a week)
      
     Args:
         adjusted_chance: the chance of a patient flare on a given day
+        rng: numpy.random.Generator to draw the duration from (a fresh one if not given)
     
     Returns:
         tuple or None: (flare_extend, flare_duration) if prolonged flare, None otherwise
     '''
-    flare_continue_thresh = 0.5  # Lower threshold seems more realistic
+    flare_continue_thresh = FLARE_CONTINUE_THRESHOLD  # Lower threshold seems more realistic
     
     if flare_continue_thresh < adjusted_chance:
         flare_extend = True
-        flare_duration = np.random.choice([1, 2, 3, 4, 5, 6], 
-                             p=[0.4, 0.3, 0.1, 0.1, 0.05, 0.05])  # Probabilities sum to 1.0
+        if rng is None:
+            rng = np.random.default_rng()
+        flare_duration = rng.choice(FLARE_DURATIONS, 
+                             p=FLARE_DURATION_PROBABILITIES)
     
         return flare_extend, flare_duration
     else:
         return False, 0  
+
+def _flare_chance_array(disease_activity, rng, baseline_chance=BASELINE_FLARE_CHANCE, adjusted_chance=None):
+    """
+    Vectorised version of _flare_chance for a whole cohort
+    
+    Args:
+        disease_activity: Array of disease activity scores, one per patient
+        rng: numpy.random.Generator used for the daily draws
+        baseline_chance: Base probability of flare (0-1)
+        adjusted_chance: Array from _adjusted_flare_chance for disease_activity, skips recomputing it
+        
+    Returns:
+        numpy.ndarray: Adjusted flare chance where a flare occurs, 0.0 otherwise
+    """
+    rand_value = rng.uniform(0.2, 0.75, size=disease_activity.shape)
+    if adjusted_chance is None:
+        adjusted_chance = _adjusted_flare_chance(disease_activity, baseline_chance)
+    return np.where(rand_value < adjusted_chance, adjusted_chance, 0.0)
+
+def _flare_longevity_array(adjusted_chance, rng):
+    """
+    Vectorised version of _flare_longetivty for a whole cohort
+    
+    Args:
+        adjusted_chance: Array of flare chances from _flare_chance_array (0.0 where no flare)
+        rng: numpy.random.Generator used for the duration draws
+        
+    Returns:
+        numpy.ndarray: Flare duration in days for prolonged flares, 0 otherwise
+    """
+    flare_continue_thresh = FLARE_CONTINUE_THRESHOLD
+    
+    flare_duration = np.zeros(adjusted_chance.shape, dtype=np.int64)
+    flare_extend = adjusted_chance > flare_continue_thresh
+    if flare_extend.any():
+        flare_duration[flare_extend] = rng.choice(FLARE_DURATIONS,
+                                                  size=int(flare_extend.sum()),
+                                                  p=FLARE_DURATION_PROBABILITIES)
+    return flare_duration
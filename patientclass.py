@@ -1,48 +1,187 @@
-import random
 import numpy as np
 class patientPainGenerator:
     '''Patient class to generate per day pain score data '''
-    def __init__(self, id, das_score, seed = None, noise_amplitude = 1.2):
-        
-        from flare_determination import _flare_chance, _flare_longetivty
-        from treatment_determination import _responding_treatment_type, _treatment_effect
-        from das_score_changes import _reduce_das_on_dmard, _increase_das_on_flare
+    # Compact array-backed state: no per-instance __dict__, one float32 and one uint8 slot per day
+    __slots__ = (
+        'id', 'das_score', 'pain_persistence', 'noise_amplitude',
+        'pain',                 # float32 pain score per day
+        'events',               # uint8 event code per day: started treatment code + 1 (0 = none), FLARE_EVENT bit on flare days
+        'treatment_days',       # int32 days on treatment per treatment code, -1 when not on it
+        'treatment_responses',  # float64 response factor per treatment code (kept exact for resuming)
+        'registry',             # TreatmentRegistry giving the treatment codes and profiles
+        'profiler',             # SimulationProfiler of the last profiled run, None if never profiled
+        'dynamic_das',          # True when DMARDs and flares change the DAS score during the run
+        'das_history',          # float64 DAS score per day, None unless dynamic_das (the score is then constant)
+        # Saved simulation state so the run can be extended later
+        '_rng', '_noise_rng', '_flare_rng', '_treatment_noise',
+        '_recent_pain', '_last_pain', '_flare_state', '_dmard_counter', '_treatments', '_das',
+    )
 
-        active_flare = 0
-        flare_days_remaining = 0
-        days = 1000
+    def __init__(self, id, das_score, seed = None, noise_amplitude = 1.2, registry = None, days = 1000, profile = False,
+                 dynamic_das = False, backend = "python"):
+        
+        from treatment_determination import NormalBatch, PainWindow, TREATMENT_REGISTRY, TREATMENT_RESPONSE_RANGES
 
-        if seed is not None:
-            random.seed(seed)
-            np.random.seed(seed)
-        patient_pain_persistence = random.uniform(0.7,0.95)  
+        # Per-patient generator (seed may be an int, SeedSequence or Generator), global random state is never touched
+        rng = np.random.default_rng(seed)
+        patient_pain_persistence = rng.uniform(0.7,0.95)  
 
         # Initial values for pain data generations
         self.id = str(id)
-        self.das_score = float(das_score)
+        self.das_score = float(das_score) # DAS score at day 0
+        self.dynamic_das = dynamic_das
+        self._das = self.das_score # current DAS score
+        self.das_history = np.array([self.das_score]) if dynamic_das else None
         self.pain_persistence = patient_pain_persistence # persistence factor (how much previous pain influences current)
         self.noise_amplitude = noise_amplitude # random fluctuation amplitude
-        self.pain_data = {} # dictionary to store pain data
-        self.treatments = {} #Active treatment dictionary, Key = treatment_type, Value = days_on_treatment 
-        self.treatment_history = []
-        self.pain_data[0] = min(10, max(1, self.das_score * 1.8))  #Initialise the pain for day 1
-        self.treatment_response = {
-        "emergency_steroid": random.uniform(0.5, 1),
-        "nsaid": random.uniform(0.5, 1),
-        "dmard": random.uniform(0.7, 1),
-        "biologic": random.uniform(0.7, 1),
-        "physical_therapy": random.uniform(0, 1)
-    } # random determination of scale of response to treatment
-        self.treatment_start_days = {}
+        self.registry = registry if registry is not None else TREATMENT_REGISTRY # treatment profiles
+        treatment_types = self.registry.types
+        self._last_pain = min(10, max(1, self.das_score * 1.8))  #Initialise the pain for day 1
+        self.pain = np.array([self._last_pain], dtype=np.float32) # grows as days are simulated
+        self.events = np.zeros(1, dtype=np.uint8)
+        self.treatment_days = np.full(len(treatment_types), -1, dtype=np.int32) # no active treatments
+        self._treatments = {} # active treatments in start order (effect draws follow this order)
+        self.treatment_responses = np.array([
+            rng.uniform(*TREATMENT_RESPONSE_RANGES.get(treatment, (0, 1)))
+            for treatment in treatment_types
+        ]) # random determination of scale of response to treatment
+        self._recent_pain = PainWindow(size=7) # rolling 7 day window used for treatment decisions
+        self._recent_pain.push(self._last_pain)
+        self._flare_state = (False, 0, None) # (active_flare, flare_days_remaining, flare_pain_level)
+        self._dmard_counter = 0
+        self.profiler = None
+
+        # Separate streams for the bulk daily draws, so extending a run in steps
+        # gives exactly the same days as simulating the whole horizon at once
+        self._rng = rng
+        self._noise_rng, self._flare_rng, treatment_rng = rng.spawn(3)
+        self._treatment_noise = NormalBatch(treatment_rng) # treatment response variation, drawn in batches
+
+        self.simulate(days, profile, backend)
+
+    @property
+    def days(self):
+        """Number of simulated days, including day 0"""
+        return len(self.pain)
+
+    def simulate(self, days, profile = False, backend = "python"):
+        """
+        Extend the simulation up to the given horizon, continuing from the saved state
+        
+        Args:
+            days: Total number of days (including day 0) the patient should have, nothing is re-run
+            profile: True to time the FLARE, TREATMENT and DAS stages of this run, or a SimulationProfiler
+                to accumulate into (e.g. over a cohort); the profiler is kept on self.profiler
+            backend: "python" runs the day loop in Python, "numba" runs it compiled (see compiled_simulation),
+                "auto" uses numba when it is installed and Python otherwise; the output is the same
+            
+        Returns:
+            patientPainGenerator: self, to allow chaining
+        """
+        if backend != "python":
+            from compiled_simulation import _resolve_backend
+            backend = _resolve_backend(backend)
+
+        first_day = len(self.pain)
+        if days <= first_day:
+            return self
+
+        # Opt-in instrumentation, the day loop only checks `profiler is not None` when disabled
+        profiler = None
+        stage_start = None
+        if profile:
+            from simulation_profiler import SimulationProfiler
+            profiler = profile if isinstance(profile, SimulationProfiler) else SimulationProfiler()
+            self.profiler = profiler
+            profiler.start_run(days - first_day)
+            stage_start = profiler._run_start
+
+        # Grow the arrays to the new horizon
+        self.pain = np.concatenate([self.pain, np.empty(days - first_day, dtype=np.float32)])
+        self.events = np.concatenate([self.events, np.zeros(days - first_day, dtype=np.uint8)])
+        if self.das_history is not None:
+            self.das_history = np.concatenate([self.das_history, np.full(days - first_day, self._das)])
+
+        rng = self._rng
+        treatment_noise = self._treatment_noise
+
+        # Daily noise and flare draws for the new days, drawn up front
+        random_factors = np.array([-0.5, 0, 0.5])[(self._noise_rng.random(days - first_day) * 3).astype(int)] # introducing noise
+        flare_draws = 0.2 + 0.55 * self._flare_rng.random(days - first_day) # uniform(0.2, 0.75)
+
+        if profiler is not None:
+            from simulation_profiler import _CountingGenerator, _CountingNoise
+            rng = _CountingGenerator(rng, profiler, 'rng')
+            treatment_noise = _CountingNoise(treatment_noise, profiler, 'treatment_noise')
+            profiler.count_draws('noise', days - first_day)
+            profiler.count_draws('flare', days - first_day)
+            stage_start = profiler.lap('setup', stage_start)
+
+        if backend == "numba":
+            from compiled_simulation import _simulate_compiled
+            stage_start = _simulate_compiled(self, first_day, days, random_factors, flare_draws,
+                                             rng, treatment_noise, profiler, stage_start)
+        else:
+            stage_start = self._run_days(first_day, days, random_factors, flare_draws, first_day,
+                                         rng, treatment_noise, profiler, stage_start)
+
+        # Hand the unused normals back to the generator, an idle patient keeps no batch
+        self._treatment_noise.release()
+
+        if profiler is not None:
+            profiler.end_run()
+        return self
+
+    def _run_days(self, start, end, random_factors, flare_draws, draw_offset, rng, treatment_noise,
+                  profiler = None, stage_start = None):
+        """
+        Run the day loop from start to end (exclusive), restoring and saving the simulation state
+        
+        Args:
+            start: First day to simulate
+            end: Day to stop before
+            random_factors: Pre-drawn noise steps, random_factors[day - draw_offset] is used on day
+            flare_draws: Pre-drawn uniform(0.2, 0.75) flare values, indexed like random_factors
+            draw_offset: Day of the first entry of the pre-drawn arrays
+            rng: Generator for the flare duration and response decline draws
+            treatment_noise: NormalBatch for the treatment response variation
+            profiler: Optional SimulationProfiler timing the stages
+            stage_start: Start time of the current profiler stage
+            
+        Returns:
+            float or None: Start time of the next profiler stage
+        """
+        from flare_determination import _adjusted_flare_chance, _flare_chance, _flare_longetivty, FLARE_PAIN_SCORE, FLARE_EVENT
+        from treatment_determination import (
+            _responding_treatment_type,
+            _treatment_effect,
+            RESPONSE_DECLINE_CHANCE,
+            RESPONSE_DECLINE_MIN,
+            RESPONSE_FLOOR,
+            RESPONSE_REDUCTION_RANGE,
+        )
+        from das_score_changes import _reduce_das_on_dmard, _increase_das_on_flare
+
+        # Restore the saved state
+        treatment_types = self.registry.types
+        treatment_codes = {treatment: code for code, treatment in enumerate(treatment_types)}
+        treatments = self._treatments #Active treatment dictionary, Key = treatment_type, Value = days_on_treatment 
+        treatment_response = dict(zip(treatment_types, self.treatment_responses.tolist()))
+        recent_pain = self._recent_pain
+        previous_pain = self._last_pain
+        active_flare, flare_days_remaining, flare_pain_level = self._flare_state
         
         #dmard Logic
-        dmard_counter = 0
-        dmard_response = self.treatment_response['dmard']
+        dmard_counter = self._dmard_counter
+
+        # DAS score and the flare chance it gives, the chance is only recomputed when the score changes
+        dynamic_das = self.dynamic_das
+        das_score = self._das
+        flare_chance = _adjusted_flare_chance(das_score)
 
         # For loop in order to model pain data and store within patient class
-        for day in range(1,days):
-            previous_pain = self.pain_data[day-1] # defining how much pain is carried across
-            random_factor = random.choice([-0.5, 0, 0.5]) # introducing noise
+        for day in range(start, end):
+            random_factor = random_factors[day - draw_offset]
 
         #------------- FLARE MODULE -------------#
         # Active flare maintain the same pain level, end on duration time-out
@@ -53,12 +192,14 @@ class patientPainGenerator:
                     active_flare = False    
 
             # Flare calculations
-            adjusted_chance_flare = _flare_chance(disease_activity = self.das_score)
+            adjusted_chance_flare = _flare_chance(disease_activity = das_score, rand_value = flare_draws[day - draw_offset],
+                                                  adjusted_chance = flare_chance)
             
             # Flare instance
             if adjusted_chance_flare is not None: 
-                flare_extend, flare_duration = _flare_longetivty(adjusted_chance_flare)
-                flare_pain_score = 4
+                flare_extend, flare_duration = _flare_longetivty(adjusted_chance_flare, rng)
+                flare_pain_score = FLARE_PAIN_SCORE
+                self.events[day] |= FLARE_EVENT
                 
                 # Pain adjust on flare
                 new_pain = (previous_pain) + (self.noise_amplitude * random_factor) + (flare_pain_score)
@@ -72,43 +213,45 @@ class patientPainGenerator:
                 # No flare therefore normal pain calculation
                 new_pain = (previous_pain) + (self.noise_amplitude * random_factor)
 
+            if profiler is not None:
+                stage_start = profiler.lap('flare', stage_start)
+
             #------------- TREATMENT MODULE -------------#
             # Treatment start on pain threshold
             if day > 7:
                 new_treatment, dmard_counter = _responding_treatment_type(
                     new_pain, 
-                    self.pain_data,
-                    self.das_score,
+                    recent_pain,
+                    das_score,
                     dmard_counter
                 )
                 
                 # Start new treatment logic - if recommended and not already on it - MAYBE WE ADD IN THAT ONLY CERTAIN # OF TREATMENTS AT ANYONE TIME?
-                if new_treatment and new_treatment not in self.treatments: # and len(self.treatments) < 5: # limit to 2 treatments at anyone time
-                    self.treatments[new_treatment] = 0
-                    self.treatment_history.append(new_treatment)
-                    # self.treatment_start_days[new_treatment] = day # Old line
-                    if new_treatment not in self.treatment_start_days:
-                        self.treatment_start_days[new_treatment] = []
-                    self.treatment_start_days[new_treatment].append(day) # New: Append to list
+                if new_treatment and new_treatment not in treatments: # and len(treatments) < 5: # limit to 2 treatments at anyone time
+                    treatments[new_treatment] = 0
+                    self.events[day] |= treatment_codes[new_treatment] + 1 # Record the start day
                     if new_treatment == 'dmard':
                         dmard_counter += 1
 
+            if profiler is not None:
+                stage_start = profiler.lap('treatment_decision', stage_start)
+
             # Apply treatment effects to pain (inc. duration of effect)
             treatment_effect = 0
-            for treatment, days_used in list(self.treatments.items()):
-                effect, treatment_dict = _treatment_effect(treatment, days_used)
+            for treatment, days_used in list(treatments.items()):
+                effect, treatment_dict = _treatment_effect(treatment, days_used, registry=self.registry, noise=treatment_noise)
                 max_effect, onset_days, duration_days, variability = treatment_dict[treatment]
 
                 # Add 1 to value of days_used for onset days and treament duration logic
-                self.treatments[treatment] += 1
+                treatments[treatment] += 1
                 # Treatment duration logic - deleted at end of duration
                 if days_used >= duration_days:
-                    del self.treatments[treatment]
+                    del treatments[treatment]
                 # Chance to reduce response to treatment to low responder randomly
                 if treatment in ['dmard', 'biologic']:
-                    if random.random() < 0.01 and self.treatment_response[treatment] > 0.3:  # 1% chance per month of becoming a lower responder
-                        reduction = random.uniform(0.3, 0.5) # Reduce response by 30-50%
-                        self.treatment_response[treatment] = max(0.2, self.treatment_response[treatment] - reduction)
+                    if rng.random() < RESPONSE_DECLINE_CHANCE and treatment_response[treatment] > RESPONSE_DECLINE_MIN:
+                        reduction = rng.uniform(*RESPONSE_REDUCTION_RANGE)
+                        treatment_response[treatment] = max(RESPONSE_FLOOR, treatment_response[treatment] - reduction)
 
                 # Normal treatment kicks in after the onset_days amoutn
                 if days_used >= onset_days:
@@ -119,67 +262,153 @@ class patientPainGenerator:
             new_pain = min(10, max(1, new_pain)) # Keep pain to the 1 - 10 scale
 
             # New Pain Data added for this day
-            self.pain_data[day] = new_pain 
+            self.pain[day] = new_pain 
+            recent_pain.push(new_pain)
+            previous_pain = new_pain # defining how much pain is carried across
+
+            if profiler is not None:
+                stage_start = profiler.lap('treatment_effect', stage_start)
 
             #------------- DAS SCORE MODULE -------------#
-            das_score = _reduce_das_on_dmard(self.treatments, self.das_score)
-            das_score = _increase_das_on_flare(flare_days_remaining, self.das_score)
+            if dynamic_das:
+                new_das = _reduce_das_on_dmard(treatments, das_score)
+                new_das = _increase_das_on_flare(1 if adjusted_chance_flare is not None else 0, new_das) # 1 = first day of a flare
+                if new_das != das_score:
+                    das_score = new_das
+                    flare_chance = _adjusted_flare_chance(das_score)
+                self.das_history[day] = das_score
+
+            if profiler is not None:
+                stage_start = profiler.lap('das', stage_start)
+
+        # Save the state compactly, indexed by treatment code, so the run can be extended
+        self.treatment_days = np.array([treatments.get(t, -1) for t in treatment_types], dtype=np.int32)
+        self.treatment_responses = np.array([treatment_response[t] for t in treatment_types])
+        self._last_pain = previous_pain
+        self._flare_state = (active_flare, flare_days_remaining, flare_pain_level)
+        self._dmard_counter = dmard_counter
+        self._das = das_score
+
+        if profiler is not None:
+            stage_start = profiler.lap('save', stage_start)
+        return stage_start
+
+    @property
+    def pain_data(self):
+        """Pain score by day as a {day: pain} dictionary"""
+        return dict(enumerate(self.pain.tolist()))
+
+    @property
+    def treatment_start_days(self):
+        """Start days of each treatment as a {treatment_type: [day, ...]} dictionary"""
+        from flare_determination import FLARE_EVENT
+
+        treatment_types = self.registry.types
+        treatment_codes = self.events & ~np.uint8(FLARE_EVENT)
+        start_days = {}
+        for day in np.flatnonzero(treatment_codes):
+            start_days.setdefault(treatment_types[treatment_codes[day] - 1], []).append(int(day))
+        return start_days
+
+    @property
+    def treatment_history(self):
+        """Treatments in the order they were started"""
+        from flare_determination import FLARE_EVENT
 
+        treatment_types = self.registry.types
+        treatment_codes = self.events & ~np.uint8(FLARE_EVENT)
+        return [treatment_types[code - 1] for code in treatment_codes[treatment_codes > 0]]
 
+    @property
+    def treatments(self):
+        """Active treatments at the end of the run as a {treatment_type: days_on_treatment} dictionary"""
+        return {t: int(d) for t, d in zip(self.registry.types, self.treatment_days) if d >= 0}
+
+    @property
+    def treatment_response(self):
+        """Response factor per treatment as a {treatment_type: factor} dictionary"""
+        return dict(zip(self.registry.types, self.treatment_responses.tolist()))
 
     # Class method to generate the dataframe of patient pain
     def get_pain_dataframe(self):
         """
-        Convert the pain_data dictionary to a pandas DataFrame
+        Convert the pain array to a pandas DataFrame
         
         Returns:
             pandas.DataFrame: DataFrame containing patient pain data with treatment start indicators
         """
         import pandas as pd
         
-        # Create dataframe from dictionary
+        # Create dataframe straight from the pain array
         df = pd.DataFrame({
-            'day': list(self.pain_data.keys()),
-            'pain_score': list(self.pain_data.values())
+            'day': np.arange(len(self.pain)),
+            'pain_score': self.pain
         })
         
         # Add patient metadata
         df['patient_id'] = self.id
-        df['das_score'] = self.das_score
-        
-        # Get all treatment types from treatment_response dictionary
-        treatment_types = list(self.treatment_response.keys())
-        
-        # Add boolean columns for treatment starts
-        for treatment in treatment_types:
-            column_name = f"started_{treatment}"
-            df[column_name] = False  # Initialize all as False
-        
-        # Treatment onset days mapping
-        treatment_onset = {
-            "emergency_steroid": 1,
-            "nsaid": 1,
-            "dmard": 14,
-            "biologic": 28,
-            "physical_therapy": 7
-        }
+        df['das_score'] = self.das_history if self.das_history is not None else self.das_score # per day when dynamic
         
-        # Fill in treatment start information, adjusted for onset days
-        for treatment, start_days_list in self.treatment_start_days.items():
-            column_name = f"started_{treatment}"
-            for start_day in start_days_list:
-                # Adjust start day to when effects actually begin
-                effect_start_day = start_day - treatment_onset.get(treatment, 0)
-                # Make sure the day exists in our data range
-                if effect_start_day in df['day'].values:
-                    mask = df['day'] == effect_start_day
-                    df.loc[mask, column_name] = True
+        # Boolean columns for treatment starts, adjusted for onset days
+        from flare_determination import FLARE_EVENT
+        from treatment_determination import _treatment_start_matrix
+        started = _treatment_start_matrix(self.events & ~np.uint8(FLARE_EVENT), df['day'].values, self.registry)
+        for code, treatment in enumerate(self.registry.types):
+            df[f"started_{treatment}"] = started[:, code]
         
         return df
-from plot_pain import plot_pain_over_time
 
-p1 = patientPainGenerator('p1', 7, seed = 66)
-df = p1.get_pain_dataframe()
-print(df)
+def cohort_pain_dataframe(patients):
+    """
+    Build one long-format DataFrame for a list of patients straight from their arrays
+    
+    Args:
+        patients: patientPainGenerator objects sharing one treatment registry
+        
+    Returns:
+        pandas.DataFrame: Same rows and columns as concatenating every patient's get_pain_dataframe
+    """
+    import pandas as pd
+    from flare_determination import FLARE_EVENT
+    from treatment_determination import _treatment_start_matrix, TREATMENT_REGISTRY
+
+    if not patients:
+        return pd.DataFrame(columns=['day', 'pain_score', 'patient_id', 'das_score']
+                            + [f"started_{treatment}" for treatment in TREATMENT_REGISTRY.types])
+
+    registry = patients[0].registry
+    lengths = [len(patient.pain) for patient in patients]
+    days = np.concatenate([np.arange(length) for length in lengths])
+
+    df = pd.DataFrame({
+        'day': days,
+        'pain_score': np.concatenate([patient.pain for patient in patients]),
+        'patient_id': np.repeat([patient.id for patient in patients], lengths),
+        'das_score': np.concatenate([patient.das_history if patient.das_history is not None
+                                     else np.full(length, patient.das_score)
+                                     for patient, length in zip(patients, lengths)]),
+    })
+
+    events = np.concatenate([patient.events for patient in patients])
+    started = _treatment_start_matrix(events & ~np.uint8(FLARE_EVENT), days, registry)
+    for code, treatment in enumerate(registry.types):
+        df[f"started_{treatment}"] = started[:, code]
+
+    return df
+
+def main():
+    """
+    Demo: simulate and plot one patient (plotting is only imported here, not on import of this module)
+    """
+    import matplotlib.pyplot as plt
+    from plot_pain import plot_pain_over_time
+
+    p1 = patientPainGenerator('p1', 7, seed = 66)
+    df = p1.get_pain_dataframe()
+    print(df)
+
+    plot_pain_over_time(df)
+    plt.show()
 
-plot_pain_over_time(df)
+if __name__ == "__main__":
+    main()
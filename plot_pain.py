@@ -1,8 +1,26 @@
 import matplotlib.pyplot as plt
-import seaborn as sns
+from matplotlib.figure import Figure
 import numpy as np
 
-def plot_pain_over_time(df, show_plot=True):
+# Treatment colors
+TREATMENT_COLORS = {
+    'emergency_steroid': '#E63946',  # Refined red
+    'nsaid': '#F9A826',  # Warm amber
+    'dmard': '#2A9D8F',  # Teal
+    'biologic': '#9B5DE5',  # Soft purple
+    'physical_therapy': '#4895EF'  # Sky blue
+}
+
+_style_applied = False
+_figure_cache = {} # figsize -> Figure reused between calls
+
+def _apply_style():
+    """Set the plot style and fonts once per process instead of on every plot"""
+    global _style_applied
+    if _style_applied:
+        return
+    import seaborn as sns
+
     plt.style.use('seaborn-v0_8')
     sns.set_palette("deep")
     plt.rcParams.update({
@@ -10,53 +28,172 @@ def plot_pain_over_time(df, show_plot=True):
         'font.sans-serif': ['Segoe UI', 'Arial', 'Helvetica', 'DejaVu Sans'],
         'font.size': 10,
     })
+    _style_applied = True
+
+def _get_figure(figsize, reuse_figure):
+    """
+    Return a figure and axis to draw on, reusing a cached figure when asked
+
+    The cached figures are not registered with pyplot, so closing them
+    through pyplot (as Shiny does after rendering) leaves them reusable.
+    """
+    if not reuse_figure:
+        return plt.subplots(figsize=figsize)
+
+    fig = _figure_cache.get(figsize)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        fig.add_subplot()
+        _figure_cache[figsize] = fig
+    else:
+        fig.set_size_inches(figsize)
+    ax = fig.axes[0]
+    ax.clear()
+    return fig, ax
+
+def _downsample(days, pain, max_points):
+    """
+    Reduce a long series to about max_points, keeping the min and max of each bucket so flares stay visible
+
+    Returns:
+        tuple: (days, pain) arrays to plot
+    
+    Raises:
+        ValueError: max_points below 2 (each bucket keeps two points)
+    """
+    if max_points is not None and max_points < 2:
+        raise ValueError(f"max_points must be at least 2 or None, got {max_points}")
+    if max_points is None or len(days) <= max_points:
+        return days, pain
+
+    bucket = int(np.ceil(len(days) / (max_points // 2)))
+    n_buckets = int(np.ceil(len(days) / bucket))
+    padded = np.full(n_buckets * bucket, np.nan)
+    padded[:len(pain)] = pain
+    buckets = padded.reshape(n_buckets, bucket)
+    starts = np.arange(n_buckets) * bucket
+
+    # Position of the min and max inside each bucket, kept in day order
+    low = np.nanargmin(buckets, axis=1)
+    high = np.nanargmax(buckets, axis=1)
+    positions = np.sort(np.stack([starts + low, starts + high], axis=1), axis=1).ravel()
+    return days[positions], pain[positions]
+
+def plot_pain_over_time(df, show_plot=True, reuse_figure=False, max_points=2000):
+    """
+    Plot one patient's pain score with a dashed marker on each treatment start
+
+    Args:
+        df: DataFrame from patientPainGenerator.get_pain_dataframe (optionally filtered)
+        show_plot: Kept for compatibility, the figure is returned either way
+        reuse_figure: Draw on a cached figure instead of creating a new one (for repeated rendering in the app)
+        max_points: Downsample the pain line above this many days (at least 2), None to always draw every day
+
+    Returns:
+        matplotlib.figure.Figure: The figure
+    """
+    _apply_style()
 
     # Create figure and axis
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig, ax = _get_figure((12, 6), reuse_figure)
 
     # Plot pain score over time
-    ax.plot(df['day'], df['pain_score'], marker='o', markersize=3, linewidth=1, label='Pain Score')
+    days = df['day'].values
+    plot_days, plot_pain = _downsample(days, df['pain_score'].values, max_points)
+    downsampled = len(plot_days) < len(days)
+    ax.plot(plot_days, plot_pain, marker=None if downsampled else 'o', markersize=3, linewidth=1, label='Pain Score')
 
     # Add labels and title
     ax.set_xlabel('Day')
     ax.set_ylabel('Pain Score')
     ax.set_title(f'Pain Score Over Time: Patient {df["patient_id"].iloc[0]} (DAS Score: {df["das_score"].iloc[0]})')
 
-    # Treatment colors
-    treatment_colors = {
-        'emergency_steroid': '#E63946',  # Refined red
-        'nsaid': '#F9A826',  # Warm amber
-        'dmard': '#2A9D8F',  # Teal
-        'biologic': '#9B5DE5',  # Soft purple
-        'physical_therapy': '#4895EF'  # Sky blue
-    }
-    
     treatment_started_columns = [col for col in df.columns if col.startswith('started_')]
-    treatment_labels_added = set()  # Track which treatments have been added to the legend
-    
+
+    # One vlines collection per treatment instead of an axvline per start day
     for col in treatment_started_columns:
         treatment_name = col.replace('started_', '')
-        color = treatment_colors.get(treatment_name, 'gray')
-        
+        color = TREATMENT_COLORS.get(treatment_name, 'gray')
+
         # Find days where this treatment started
-        treatment_days = df[df[col] == True]['day'].values
-        
-        for day in treatment_days:
-            # Only add the treatment to the legend once
-            if treatment_name not in treatment_labels_added:
-                ax.axvline(x=day, color=color, linestyle='--', alpha=0.7, 
-                          label=f'{treatment_name} started')
-                treatment_labels_added.add(treatment_name)
-            else:
-                # For subsequent occurrences, don't add to legend but still show the line
-                ax.axvline(x=day, color=color, linestyle='--', alpha=0.7)
+        treatment_days = days[df[col].values.astype(bool)]
+        if len(treatment_days) == 0:
+            continue
+
+        ax.vlines(treatment_days, 0, 1, transform=ax.get_xaxis_transform(),
+                  colors=color, linestyles='--', alpha=0.7,
+                  label=f'{treatment_name} started')
 
     ax.grid(True, alpha=0.3)
     ax.set_ylim(0, 10.5)
-    
-    # Create legend 
+
+    # Create legend
     ax.legend(loc='upper right')
 
-    plt.tight_layout()
-    
-    return fig
\ No newline at end of file
+    fig.tight_layout()
+
+    return fig
+
+def plot_cohort_fan_chart(summary, overlay=None, reuse_figure=False):
+    """
+    Fan chart of the cohort pain percentile bands with the treatment uptake curves underneath
+
+    Args:
+        summary: Dict from cohort_analytics.summarise_cohort
+        overlay: Optional (patients x days) pain array of a few patients drawn as thin lines over the bands
+        reuse_figure: Draw on a cached figure instead of creating a new one
+
+    Returns:
+        matplotlib.figure.Figure: The figure
+    """
+    from matplotlib.collections import LineCollection
+
+    _apply_style()
+
+    figsize = (12, 8)
+    fig = _figure_cache.get(('fan', figsize)) if reuse_figure else None
+    if fig is None:
+        fig = Figure(figsize=figsize) if reuse_figure else plt.figure(figsize=figsize)
+        fig.subplots(2, 1, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+        if reuse_figure:
+            _figure_cache[('fan', figsize)] = fig
+    ax_pain, ax_uptake = fig.axes
+    ax_pain.clear()
+    ax_uptake.clear()
+
+    days = summary['days']
+    bands = summary['pain_bands']
+    percentiles = summary['percentiles']
+
+    # Shade symmetric percentile pairs from the outside in, then the middle one as the median line
+    n_pairs = len(percentiles) // 2
+    for i in range(n_pairs):
+        ax_pain.fill_between(days, bands[i], bands[-1 - i], color='#4895EF',
+                             alpha=0.15 + 0.2 * i, linewidth=0,
+                             label=f'{percentiles[i]}-{percentiles[-1 - i]}th percentile')
+    if len(percentiles) % 2:
+        ax_pain.plot(days, bands[n_pairs], color='#1D3557', linewidth=1.5, label=f'{percentiles[n_pairs]}th percentile')
+    ax_pain.plot(days, summary['mean_pain'], color='#E63946', linewidth=1, linestyle='--', label='Mean')
+
+    if overlay is not None and len(overlay):
+        overlay = np.asarray(overlay)[:, :len(days)]
+        segments = np.stack([np.broadcast_to(days[:overlay.shape[1]], overlay.shape), overlay], axis=-1)
+        ax_pain.add_collection(LineCollection(segments, colors='gray', linewidths=0.5, alpha=0.4))
+
+    ax_pain.set_ylabel('Pain Score')
+    ax_pain.set_ylim(0, 10.5)
+    ax_pain.set_title(f'Cohort Pain Over Time ({summary["n_patients"]} patients)')
+    ax_pain.grid(True, alpha=0.3)
+    ax_pain.legend(loc='upper right')
+
+    for treatment, curve in summary['uptake'].items():
+        ax_uptake.plot(days, curve, color=TREATMENT_COLORS.get(treatment, 'gray'), linewidth=1.5, label=treatment)
+    ax_uptake.set_xlabel('Day')
+    ax_uptake.set_ylabel('Started')
+    ax_uptake.set_ylim(0, 1.05)
+    ax_uptake.grid(True, alpha=0.3)
+    ax_uptake.legend(loc='lower right', fontsize=8)
+
+    fig.tight_layout()
+
+    return fig
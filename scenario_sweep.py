@@ -0,0 +1,200 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cohort_analytics import _first_treatment_days
+from cohort_generation import _patient_seed_sequence, TriangularDAS
+from flare_determination import FLARE_EVENT
+from treatment_determination import TREATMENT_REGISTRY
+
+PROFILE_FIELDS = ("max_effect", "onset_days", "duration_days", "variability")
+
+def scenario_grid(noise=(1.2,), das_samplers=(TriangularDAS(),), treatments=({},), dynamic_das=(False,)):
+    """
+    Every combination of the given parameter values as a list of scenarios
+
+    Args:
+        noise: Noise amplitudes
+        das_samplers: DAS samplers (e.g. TriangularDAS with different ranges)
+        treatments: Treatment overrides, each a {treatment: {field: value}} dict applied on top of the
+            default profiles ({} keeps the defaults), fields as in PROFILE_FIELDS
+        dynamic_das: Values of the dynamic_das switch
+
+    Returns:
+        list: Scenario dicts with 'name', 'noise', 'das_sampler', 'treatments' and 'dynamic_das'
+    """
+    scenarios = []
+    for noise_amplitude, das_sampler, overrides, dynamic in itertools.product(noise, das_samplers, treatments, dynamic_das):
+        scenarios.append({
+            'name': _scenario_name(noise_amplitude, das_sampler, overrides, dynamic),
+            'noise': noise_amplitude,
+            'das_sampler': das_sampler,
+            'treatments': overrides,
+            'dynamic_das': dynamic,
+        })
+    return scenarios
+
+def _scenario_name(noise, das_sampler, overrides, dynamic_das):
+    parts = [f"noise={noise}", repr(das_sampler)]
+    for treatment, fields in overrides.items():
+        parts.extend(f"{treatment}.{field}={value}" for field, value in fields.items())
+    if dynamic_das:
+        parts.append("dynamic_das")
+    return ", ".join(parts)
+
+def _scenario_registry(overrides):
+    """
+    Copy of the default registry with the scenario's profile fields replaced (treatment codes are kept)
+    """
+    if not overrides:
+        return TREATMENT_REGISTRY
+    registry = TREATMENT_REGISTRY.copy()
+    for treatment, fields in overrides.items():
+        unknown = set(fields) - set(PROFILE_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown profile fields for {treatment}: {sorted(unknown)}")
+        if treatment not in registry:
+            raise ValueError(f"Unknown treatment: {treatment}")
+        profile = dict(zip(PROFILE_FIELDS, registry[treatment]))
+        profile.update(fields)
+        registry.register(treatment, *(profile[field] for field in PROFILE_FIELDS))
+    return registry
+
+def _simulate_scenario_chunk(chunk_args):
+    """
+    Process pool worker: simulate one chunk of patients under every scenario
+
+    Patient index i gets the same seed in every scenario (the seed
+    generate_cohort gives it), so scenarios are compared on common random
+    numbers. DAS draws are made once per chunk and shared by the scenarios
+    that use the same sampler. The registries come from run_sweep, this
+    worker never reads its own TREATMENT_REGISTRY.
+
+    Args:
+        chunk_args: Tuple of (scenarios, registries, seed, start, n, days), one registry per scenario
+
+    Returns:
+        list: Per scenario, a dict of per-patient outcome arrays ('mean_pain', 'final_pain', 'flare_rate', 'first_start')
+    """
+    from patientclass import patientPainGenerator
+
+    scenarios, registries, seed, start, n, days = chunk_args
+    master_seed = np.random.SeedSequence(seed)
+    das_scores = {}
+
+    results = []
+    for scenario, registry in zip(scenarios, registries):
+        sampler = scenario['das_sampler']
+        if repr(sampler) not in das_scores:
+            das_scores[repr(sampler)] = [
+                sampler(np.random.default_rng(_patient_seed_sequence(master_seed, index).spawn(2)[0]))
+                for index in range(start, start + n)
+            ]
+
+        pain = np.empty((n, days), dtype=np.float32)
+        events = np.empty((n, days), dtype=np.uint8)
+        for row, (index, das_score) in enumerate(zip(range(start, start + n), das_scores[repr(sampler)])):
+            # A fresh seed sequence per scenario, spawning from a shared one would move its children on
+            simulation_seed = _patient_seed_sequence(master_seed, index).spawn(2)[1]
+            patient = patientPainGenerator(index + 1, das_score, seed=simulation_seed, noise_amplitude=scenario['noise'],
+                                           registry=registry, days=days,
+                                           dynamic_das=scenario.get('dynamic_das', False))
+            pain[row] = patient.pain
+            events[row] = patient.events
+
+        results.append({
+            'mean_pain': pain.mean(axis=1, dtype=np.float64),
+            'final_pain': pain[:, -1].astype(np.float64),
+            'flare_rate': np.count_nonzero(events & np.uint8(FLARE_EVENT), axis=1) / days,
+            'first_start': _first_treatment_days(events, len(registry)),
+        })
+    return results
+
+def run_sweep(scenarios, n, seed=None, days=1000, workers=None, chunk_size=100):
+    """
+    Run every scenario over the same seeded cohort and summarise the outcomes per scenario
+
+    Differences between scenarios come from the parameters only: each
+    patient is simulated from the same random streams in every scenario.
+    The paired differences to the first (baseline) scenario therefore
+    have a much smaller standard error than comparing independent cohorts.
+
+    Args:
+        scenarios: List of scenario dicts, e.g. from scenario_grid (the first one is the baseline)
+        n: Number of patients per scenario
+        seed: Master seed of the cohort (None for fresh entropy, still shared by all scenarios)
+        days: Simulation horizon per patient (including day 0)
+        workers: Number of worker processes, 1 runs in this process, None uses every core
+        chunk_size: Patients per worker task, each task runs its patients under every scenario
+
+    Returns:
+        pandas.DataFrame: One row per scenario indexed by scenario name, with the scenario parameters and
+            - 'mean_pain', 'mean_pain_se': mean over patients of each patient's average pain, and its standard error
+            - 'mean_pain_vs_baseline', 'mean_pain_vs_baseline_se': paired difference to the baseline scenario
+            - 'final_pain': mean pain on the last day
+            - 'flare_rate': fraction of patient days with a flare
+            - 'started_<treatment>': fraction of patients who started the treatment
+            - 'median_day_<treatment>': median first start day of the patients who started it
+    """
+    import pandas as pd
+
+    if not scenarios:
+        raise ValueError("run_sweep needs at least one scenario")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if seed is None:
+        seed = np.random.SeedSequence().entropy # every scenario and chunk must share one master seed
+
+    # Registries are built here, once per distinct override set, so workers started without this
+    # process's register_treatment_profile calls (spawn, forkserver) still use the same profiles
+    registries_by_overrides = {}
+    for scenario in scenarios:
+        overrides_key = repr(scenario['treatments'])
+        if overrides_key not in registries_by_overrides:
+            registries_by_overrides[overrides_key] = _scenario_registry(scenario['treatments'])
+    registries = [registries_by_overrides[repr(scenario['treatments'])] for scenario in scenarios]
+
+    chunk_args = [(scenarios, registries, seed, start, min(chunk_size, n - start), days)
+                  for start in range(0, n, chunk_size)]
+    if workers <= 1 or len(chunk_args) <= 1:
+        chunk_results = [_simulate_scenario_chunk(args) for args in chunk_args]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_results = list(executor.map(_simulate_scenario_chunk, chunk_args))
+
+    # Stitch the chunks back together per scenario, in patient order
+    outcomes = [
+        {key: np.concatenate([chunk[i][key] for chunk in chunk_results]) for key in chunk_results[0][i]}
+        for i in range(len(scenarios))
+    ]
+    baseline = outcomes[0]['mean_pain']
+
+    rows = []
+    for scenario, registry, outcome in zip(scenarios, registries, outcomes):
+        difference = outcome['mean_pain'] - baseline
+        row = {
+            'scenario': scenario.get('name') or _scenario_name(scenario['noise'], scenario['das_sampler'],
+                                                               scenario['treatments'], scenario.get('dynamic_das', False)),
+            'noise': scenario['noise'],
+            'das_sampler': repr(scenario['das_sampler']),
+            'treatments': repr(scenario['treatments']),
+            'dynamic_das': scenario.get('dynamic_das', False),
+            'n_patients': n,
+            'days': days,
+            'mean_pain': outcome['mean_pain'].mean(),
+            'mean_pain_se': outcome['mean_pain'].std(ddof=1) / np.sqrt(n) if n > 1 else np.nan,
+            'mean_pain_vs_baseline': difference.mean(),
+            'mean_pain_vs_baseline_se': difference.std(ddof=1) / np.sqrt(n) if n > 1 else np.nan,
+            'final_pain': outcome['final_pain'].mean(),
+            'flare_rate': outcome['flare_rate'].mean(),
+        }
+        for code, treatment in enumerate(registry.types):
+            started = outcome['first_start'][:, code]
+            started = started[started >= 0]
+            row[f"started_{treatment}"] = len(started) / n
+            row[f"median_day_{treatment}"] = float(np.median(started)) if len(started) else np.nan
+        rows.append(row)
+
+    return pd.DataFrame(rows).set_index('scenario')
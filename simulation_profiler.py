@@ -0,0 +1,179 @@
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+
+class SimulationProfiler:
+    '''Cumulative per-stage timings, call counts, RNG draws and allocations of simulation runs'''
+    def __init__(self, trace_allocations=False):
+        """
+        Args:
+            trace_allocations: Also trace peak memory with tracemalloc (slower, off by default)
+        """
+        self.trace_allocations = trace_allocations
+        self.stage_times = {} # stage -> cumulative seconds
+        self.stage_calls = {} # stage -> number of times the stage ran
+        self.rng_draws = {} # source -> number of random variates drawn
+        self.days = 0
+        self.runs = 0
+        self.total_time = 0.0
+        self.allocated_blocks = 0 # net change in allocated memory blocks over the runs
+        self.peak_memory = 0 # bytes, only with trace_allocations
+
+        self._run_start = None
+        self._blocks_start = None
+        self._started_tracing = False
+
+    def start_run(self, days):
+        """
+        Mark the start of a simulate call covering the given number of new days
+        """
+        self.days += days
+        self.runs += 1
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._blocks_start = sys.getallocatedblocks()
+        self._run_start = time.perf_counter()
+
+    def end_run(self):
+        """
+        Mark the end of the current simulate call
+        """
+        self.total_time += time.perf_counter() - self._run_start
+        self.allocated_blocks += sys.getallocatedblocks() - self._blocks_start
+        if self.trace_allocations:
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            if self._started_tracing:
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def add(self, stage, seconds):
+        """
+        Add the time of one run of a stage
+        """
+        self.stage_times[stage] = self.stage_times.get(stage, 0.0) + seconds
+        self.stage_calls[stage] = self.stage_calls.get(stage, 0) + 1
+
+    def lap(self, stage, start):
+        """
+        Add the time since start to a stage
+
+        Returns:
+            float: The current time, the start of the next stage
+        """
+        now = time.perf_counter()
+        self.add(stage, now - start)
+        return now
+
+    def count_draws(self, source, count=1):
+        """
+        Count random variates drawn from one source
+        """
+        self.rng_draws[source] = self.rng_draws.get(source, 0) + count
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: Profile summary, times in seconds
+        """
+        days = max(self.days, 1)
+        return {
+            'runs': self.runs,
+            'days': self.days,
+            'total_time': self.total_time,
+            'stages': {
+                stage: {
+                    'time': seconds,
+                    'calls': self.stage_calls[stage],
+                    'share': seconds / self.total_time if self.total_time else 0.0,
+                }
+                for stage, seconds in self.stage_times.items()
+            },
+            'untracked_time': self.total_time - sum(self.stage_times.values()),
+            'rng_draws': dict(self.rng_draws),
+            'rng_draws_per_day': sum(self.rng_draws.values()) / days,
+            'allocated_blocks': self.allocated_blocks,
+            'peak_memory': self.peak_memory if self.trace_allocations else None,
+        }
+
+    def to_json(self, path=None):
+        """
+        Export the profile as JSON
+
+        Args:
+            path: File to write, the JSON string is returned when None
+        """
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is None:
+            return text
+        with open(path, "w") as f:
+            f.write(text)
+
+    def to_collapsed(self, path=None, root="simulate"):
+        """
+        Export the stage times in collapsed stack format (one 'root;stage microseconds' line per stage),
+        as read by flamegraph.pl and speedscope
+
+        Args:
+            path: File to write, the text is returned when None
+            root: Name of the root frame
+        """
+        lines = [f"{root};{stage} {int(seconds * 1e6)}" for stage, seconds in self.stage_times.items()]
+        untracked = self.total_time - sum(self.stage_times.values())
+        if untracked > 0:
+            lines.append(f"{root} {int(untracked * 1e6)}")
+        text = "\n".join(lines) + "\n"
+        if path is None:
+            return text
+        with open(path, "w") as f:
+            f.write(text)
+
+    def __repr__(self):
+        summary = ", ".join(f"{stage}={seconds:.4f}s" for stage, seconds in self.stage_times.items())
+        return f"SimulationProfiler(days={self.days}, total={self.total_time:.4f}s, {summary})"
+
+class _CountingGenerator:
+    '''Wraps a numpy Generator and counts the variates drawn from it, draws are unchanged'''
+    def __init__(self, rng, profiler, source):
+        self._rng = rng
+        self._profiler = profiler
+        self._source = source
+        self._signatures = {} # method name -> signature, to find size however it is passed
+
+    def __getattr__(self, name):
+        method = getattr(self._rng, name)
+        if not callable(method):
+            return method # e.g. bit_generator
+        if name not in self._signatures:
+            self._signatures[name] = inspect.signature(method)
+        signature = self._signatures[name]
+
+        def counted(*args, **kwargs):
+            size = signature.bind(*args, **kwargs).arguments.get('size')
+            count = 1
+            if size is not None:
+                for n in (size if isinstance(size, tuple) else (size,)):
+                    count *= n
+            self._profiler.count_draws(self._source, count)
+            return method(*args, **kwargs)
+        return counted
+
+class _CountingNoise:
+    '''Wraps a NormalBatch and counts the normals handed out'''
+    def __init__(self, noise, profiler, source):
+        self._noise = noise
+        self._profiler = profiler
+        self._source = source
+
+    def next(self):
+        self._profiler.count_draws(self._source)
+        return self._noise.next()
+
+    def peek(self, count):
+        return self._noise.peek(count)
+
+    def skip(self, count):
+        self._profiler.count_draws(self._source, count)
+        self._noise.skip(count)
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("numba")
+
+from patientclass import patientPainGenerator
+
+# (das_score, seed) pairs across the DAS range, flare-free to flare-dense
+PATIENTS = [(1.6 + 0.4 * index, index) for index in range(21)]
+
+def _assert_same(numba_patient, python_patient):
+    np.testing.assert_array_equal(numba_patient.pain, python_patient.pain)
+    np.testing.assert_array_equal(numba_patient.events, python_patient.events)
+    if python_patient.das_history is None:
+        assert numba_patient.das_history is None
+    else:
+        np.testing.assert_array_equal(numba_patient.das_history, python_patient.das_history)
+
+@pytest.mark.parametrize("dynamic_das", [False, True])
+def test_numba_matches_python(dynamic_das):
+    for das_score, seed in PATIENTS:
+        python_patient = patientPainGenerator('p', das_score, seed=seed, days=1000, dynamic_das=dynamic_das)
+        numba_patient = patientPainGenerator('p', das_score, seed=seed, days=1000, dynamic_das=dynamic_das,
+                                             backend="numba")
+        _assert_same(numba_patient, python_patient)
+
+@pytest.mark.parametrize("dynamic_das", [False, True])
+def test_numba_matches_python_extended_in_steps(dynamic_das):
+    for das_score, seed in PATIENTS:
+        python_patient = patientPainGenerator('p', das_score, seed=seed, days=1500, dynamic_das=dynamic_das)
+        numba_patient = patientPainGenerator('p', das_score, seed=seed, days=10, dynamic_das=dynamic_das,
+                                             backend="numba")
+        for days in (11, 400, 401, 1000, 1500):
+            numba_patient.simulate(days, backend="numba")
+        _assert_same(numba_patient, python_patient)
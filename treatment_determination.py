@@ -1,97 +1,434 @@
-import random
+from collections import deque
 import numpy as np
 
-def _responding_treatment_type(pain_score, pain_history=None, das_score=None, dmard_use=None, seed=None):
+# Treatment dictionary with effect profiles
+# Format: (max_effect, onset_days, duration_days, variability)
+TREATMENT_PROFILES = {
+    # Immediate relief treatments
+    "emergency_steroid": (-0.5, 1, 21, 0.1),    # Strong, quick, short duration
+    "nsaid":            (-0.2, 1, 7, 0.3),    # Moderate, quick onset
+
+    # Delayed effect treatments
+    "dmard":            (-0.03, 14, 1800, 0.2),   # Stronger but takes 2 weeks
+    "biologic":         (-0.04, 28, 1800, 0.3),  # Strongest but takes 4 weeks
+    "physical_therapy": (-0.0015, 7, 28, 0.4)    # Mild effect, moderate onset
+}
+
+# Range of the per-patient response factor drawn for each treatment
+TREATMENT_RESPONSE_RANGES = {
+    "emergency_steroid": (0.5, 1),
+    "nsaid": (0.5, 1),
+    "dmard": (0.7, 1),
+    "biologic": (0.7, 1),
+    "physical_therapy": (0, 1)
+}
+
+# Fixed treatment order used to index treatment arrays (code = position)
+TREATMENT_TYPES = tuple(TREATMENT_PROFILES)
+
+MAX_TREATMENT_TYPES = 127 # treatment codes share a uint8 event code with the flare bit
+
+# Treatment decision thresholds on the recent pain window
+SEVERE_PAIN = 8.0 # Maximum pain that calls for an emergency steroid (acute severe flare)
+SIGNIFICANT_PAIN = 7.0 # Maximum pain that calls for an NSAID
+PERSISTENT_PAIN = 5.0 # Average pain that calls for a DMARD, or a biologic once escalated
+CHRONIC_MILD_PAIN = (4.0, 6.0) # Average pain range [low, high) that calls for physical therapy
+DMARD_ESCALATION_COUNT = 2 # DMARD starts after which persistent pain is treated with a biologic
+FULL_WINDOW_DAYS = 7 # Days of pain history the average pain rules need
+
+# Loss of response on long-term treatments (dmard, biologic)
+RESPONSE_DECLINE_CHANCE = 0.01 # Daily chance of becoming a lower responder
+RESPONSE_DECLINE_MIN = 0.3 # Responses at or below this do not decline further
+RESPONSE_REDUCTION_RANGE = (0.3, 0.5) # Uniform range of the response reduction
+RESPONSE_FLOOR = 0.2 # Lowest response left after a reduction
+
+class TreatmentProfile:
+    '''Effect profile of one treatment, compiled to lookup tables indexed by days on treatment'''
+    def __init__(self, name, max_effect, onset_days, duration_days, variability):
+        self.name = name
+        self.max_effect = max_effect
+        self.onset_days = onset_days
+        self.duration_days = duration_days
+        self.variability = variability
+
+        days_on_treatment = np.arange(int(duration_days) + 1)
+        # Gradual onset effect (linear ramp up), full effect after onset period
+        self.strength = np.minimum(days_on_treatment / onset_days, 1.0).tolist()
+
+    def __iter__(self):
+        # Unpacks as (max_effect, onset_days, duration_days, variability) like TREATMENT_PROFILES entries
+        return iter((self.max_effect, self.onset_days, self.duration_days, self.variability))
+
+    def __reduce__(self):
+        # Pickle the parameters only, the tables are rebuilt on load
+        return (TreatmentProfile, (self.name, *self))
+
+    def __repr__(self):
+        return f"TreatmentProfile{(self.name, *self)}"
+
+class TreatmentRegistry:
+    '''Ordered set of treatment profiles, a treatment's code is its registration position'''
+    def __init__(self, profiles=None):
+        self._profiles = {}
+        for name, params in (profiles or {}).items():
+            self.register(name, *params)
+
+    def register(self, name, max_effect, onset_days, duration_days, variability):
+        """
+        Add a treatment profile, or replace the profile of an existing treatment (keeping its code)
+        
+        Treatments are only started by the decision logic (_responding_treatment_type),
+        which names the built-in treatments; a new name gets a code and a profile but
+        is never started, so registering is for overriding the built-in profiles.
+        
+        Args:
+            name: Treatment type name
+            max_effect: Full daily effect on pain (negative reduces pain)
+            onset_days: Days on treatment before the effect counts
+            duration_days: Days on treatment after which the treatment stops
+            variability: Standard deviation of the daily response variation
+            
+        Returns:
+            TreatmentProfile: The compiled profile
+        """
+        if onset_days <= 0 or duration_days < 0 or variability < 0:
+            raise ValueError(f"Invalid profile for {name}: onset_days must be positive, duration_days and variability non-negative")
+        if name not in self._profiles and len(self._profiles) >= MAX_TREATMENT_TYPES:
+            raise ValueError(f"Cannot register more than {MAX_TREATMENT_TYPES} treatment types")
+        profile = TreatmentProfile(name, max_effect, onset_days, duration_days, variability)
+        self._profiles[name] = profile
+        return profile
+
+    def copy(self):
+        return TreatmentRegistry({name: tuple(profile) for name, profile in self._profiles.items()})
+
+    @property
+    def types(self):
+        """Treatment names in code order"""
+        return tuple(self._profiles)
+
+    def __getitem__(self, name):
+        return self._profiles[name]
+
+    def __contains__(self, name):
+        return name in self._profiles
+
+    def __iter__(self):
+        return iter(self._profiles)
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def __reduce__(self):
+        return (TreatmentRegistry, ({name: tuple(profile) for name, profile in self._profiles.items()},))
+
+# Default registry used by the simulators unless one is passed in
+TREATMENT_REGISTRY = TreatmentRegistry(TREATMENT_PROFILES)
+
+def register_treatment_profile(name, max_effect, onset_days, duration_days, variability):
+    """
+    Register a treatment profile in the default registry without editing this module
+    
+    Only the built-in treatments are ever started (see TreatmentRegistry.register),
+    so use this to override their profiles. Patients simulated in worker processes
+    get the registry through generate_cohort, so registrations made before the
+    call are used whatever the process start method.
+    
+    Args:
+        name: Treatment type name (an existing name replaces its profile)
+        max_effect: Full daily effect on pain (negative reduces pain)
+        onset_days: Days on treatment before the effect counts
+        duration_days: Days on treatment after which the treatment stops
+        variability: Standard deviation of the daily response variation
+        
+    Returns:
+        TreatmentProfile: The compiled profile
+    """
+    return TREATMENT_REGISTRY.register(name, max_effect, onset_days, duration_days, variability)
+
+class NormalBatch:
+    '''Standard normal draws taken from a Generator in bulk and handed out one at a time'''
+    def __init__(self, rng, batch_size=1024):
+        self.rng = rng
+        self.batch_size = batch_size
+        self._values = []
+        self._position = 0
+        # Generator state some draws before the buffer starts, so the unused values can be given back
+        self._origin_state = None # bit generator state, None while the buffer is empty
+        self._origin_offset = 0 # values drawn between that state and the first buffered value
+
+    def _draw(self, count):
+        if self._position >= len(self._values): # nothing left to hand out, the new values start the buffer
+            self._origin_state = self.rng.bit_generator.state
+            self._origin_offset = 0
+        return self.rng.standard_normal(count)
+
+    def next(self):
+        if self._position >= len(self._values):
+            self._values = self._draw(self.batch_size).tolist()
+            self._position = 0
+        value = self._values[self._position]
+        self._position += 1
+        return value
+
+    def peek(self, count):
+        """
+        Look at the next count values without handing them out (same values next() would give)
+        
+        Returns:
+            numpy.ndarray: The next count standard normals
+        """
+        shortfall = count - (len(self._values) - self._position)
+        if shortfall > 0:
+            # Refill in whole batches so the stream matches one-at-a-time refills (one call draws the same values)
+            batches = -(-shortfall // self.batch_size)
+            remaining = self._values[self._position:]
+            self._origin_offset += self._position
+            drawn = self._draw(batches * self.batch_size)
+            self._values = remaining + drawn.tolist()
+            self._position = 0
+            return np.concatenate([remaining, drawn[:count - len(remaining)]])
+        return np.array(self._values[self._position:self._position + count])
+
+    def skip(self, count):
+        """
+        Hand out count values at once, after peek has made them available
+        """
+        self._position += count
+
+    def release(self):
+        """
+        Drop the buffered values, rewinding the Generator so it draws the unused ones again
+        
+        Normal draws do not depend on how they are batched, so the values handed
+        out afterwards are the same as if the buffer had been kept. Called
+        between runs so an idle patient holds no buffer.
+        """
+        if self._origin_state is None:
+            return
+        self.rng.bit_generator.state = self._origin_state
+        self.rng.standard_normal(self._origin_offset + self._position) # the values already handed out
+        self._values = []
+        self._position = 0
+        self._origin_state = None
+        self._origin_offset = 0
+
+class PainWindow:
+    '''Fixed-size rolling window of the most recent pain scores, fed one day at a time'''
+    def __init__(self, size=7):
+        self.size = size
+        self._values = [0.0] * size # ring buffer, slot = push count % size
+        self._count = 0
+        self._sum = 0.0
+        self._max_queue = deque() # (push index, pain) pairs with decreasing pain
+
+    @classmethod
+    def from_history(cls, pain_history, size=7):
+        """
+        Build a window from the last days of a {day: pain} dictionary
+        
+        Args:
+            pain_history: Dictionary of past pain scores by day
+            size: Number of days kept in the window
+            
+        Returns:
+            PainWindow: Window holding the most recent pain scores
+        """
+        window = cls(size)
+        for day in sorted(pain_history.keys())[-size:]:
+            window.push(pain_history[day])
+        return window
+
+    def push(self, pain):
+        """
+        Add the pain score of the next day, dropping the oldest day once the window is full
+        
+        Args:
+            pain: Pain score of the newest day
+        """
+        index = self._count
+        slot = index % self.size
+        if index >= self.size:
+            self._sum -= self._values[slot]
+        self._values[slot] = pain
+        self._count += 1
+
+        # Re-anchor the running sum once per window to stop rounding drift building up
+        if slot == self.size - 1:
+            self._sum = sum(self._values)
+        else:
+            self._sum += pain
+
+        # Monotonic queue: the front always holds the window maximum
+        while self._max_queue and self._max_queue[-1][1] <= pain:
+            self._max_queue.pop()
+        self._max_queue.append((index, pain))
+        if self._max_queue[0][0] <= index - self.size:
+            self._max_queue.popleft()
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    def _restore(self, values, count, running_sum):
+        """
+        Load a window state saved elsewhere (e.g. by the compiled day loop)
+        
+        Args:
+            values: Ring buffer contents, slot = push count % size
+            count: Number of pushes so far
+            running_sum: Running sum of the window
+        """
+        self._values = list(values)
+        self._count = count
+        self._sum = running_sum
+        # The queue only depends on the window contents, rebuild it from the days in order
+        self._max_queue = deque()
+        for index in range(max(0, count - self.size), count):
+            pain = self._values[index % self.size]
+            while self._max_queue and self._max_queue[-1][1] <= pain:
+                self._max_queue.pop()
+            self._max_queue.append((index, pain))
+
+    @property
+    def mean(self):
+        return self._sum / len(self)
+
+    @property
+    def max(self):
+        return self._max_queue[0][1]
+
+def _responding_treatment_type(pain_score, pain_history=None, das_score=None, dmard_use=None):
     """
     Determine which treatment to apply based on pain patterns
     
     Args:
         pain_score: Current pain level (1-10)
-        pain_history: Dictionary of past pain scores by day # should give 'previous_pain' for integration
+        pain_history: PainWindow of recent pain scores, or dictionary of past pain scores by day # should give 'previous_pain' for integration
         das_score: Disease Activity Score
         
     Returns:
         tuple: (treatment_type, updated_dmard_use) - Treatment type to apply and updated DMARD counter   
     """
-
-    if seed is not None:
-        random.seed(seed)
-        np.random.seed(seed)
     
     # Define treatment thresholds
     if pain_history is None:
         return None, dmard_use
     
-    recent_days = sorted(pain_history.keys())[-7:] if len(pain_history) >= 7 else sorted(pain_history.keys())
-    recent_pain = [pain_history[day] for day in recent_days]
+    if not isinstance(pain_history, PainWindow):
+        pain_history = PainWindow.from_history(pain_history)
     
     # Calculate metrics to determine treatment
-    avg_pain = sum(recent_pain) / len(recent_pain)
-    max_pain = max(recent_pain)
+    window_days = len(pain_history)
+    avg_pain = pain_history.mean
+    max_pain = pain_history.max
     
     # Treatment decision logic
-    if max_pain >= 8:  # Acute severe flare
+    if max_pain >= SEVERE_PAIN:  # Acute severe flare
         return "emergency_steroid", dmard_use
-    elif max_pain >= 7.0:  # Significant pain
+    elif max_pain >= SIGNIFICANT_PAIN:  # Significant pain
         return "nsaid", dmard_use
-    elif avg_pain >= 5.0 and len(recent_pain) >= 7:  # Persistent moderate pain
-        if dmard_use >= 2:  # High disease activity
+    elif avg_pain >= PERSISTENT_PAIN and window_days >= FULL_WINDOW_DAYS:  # Persistent moderate pain
+        if dmard_use >= DMARD_ESCALATION_COUNT:  # High disease activity
             return "biologic", dmard_use
         else:
             return "dmard", dmard_use
-    elif 4.0 <= avg_pain < 6.0 and len(recent_pain) >= 7:  # Chronic mild pain
+    elif CHRONIC_MILD_PAIN[0] <= avg_pain < CHRONIC_MILD_PAIN[1] and window_days >= FULL_WINDOW_DAYS:  # Chronic mild pain
         return "physical_therapy", dmard_use
     else:
         return None, dmard_use
 
-def _treatment_effect(treatment_type, days_on_treatment=0, seed = None):
+def _treatment_effect(treatment_type, days_on_treatment=0, rng=None, seed=None, registry=None, noise=None):
     """
     Calculate the effect of a treatment based on type and duration
     
     Args:
         treatment_type: Type of treatment being used
         days_on_treatment: How many days patient has been on this treatment
+        rng: numpy.random.Generator for the response variation
+        seed: Seed for a new Generator when rng and noise are not given (global random state is never touched)
+        registry: TreatmentRegistry with the treatment profiles (default TREATMENT_REGISTRY)
+        noise: NormalBatch supplying the response variation draws, takes precedence over rng
         
     Returns:
-        float: Pain reduction effect (negative value to reduce pain)
+        tuple: (effect, registry) - Pain reduction effect (negative value to reduce pain) and the profiles used
     """
-
-    if seed is not None:
-        random.seed(seed)
-        np.random.seed(seed)
+    if registry is None:
+        registry = TREATMENT_REGISTRY
     
-    # Treatment dictionary with effect profiles
-    # Format: (max_effect, onset_days, duration_days, variability)
-    treatment_dict = {
-        # Immediate relief treatments
-        "emergency_steroid": (-0.5, 1, 21, 0.1),    # Strong, quick, short duration
-        "nsaid":            (-0.2, 1, 7, 0.3),    # Moderate, quick onset
-        
-        # Delayed effect treatments
-        "dmard":            (-0.03, 14, 1800, 0.2),   # Stronger but takes 2 weeks
-        "biologic":         (-0.04, 28, 1800, 0.3),  # Strongest but takes 4 weeks
-        "physical_therapy": (-0.0015, 7, 28, 0.4)    # Mild effect, moderate onset
-    }
-    
-    if treatment_type not in treatment_dict:
-        return 0.0
+    if treatment_type not in registry:
+        return 0.0, registry
     
-    max_effect, onset_days, duration_days, variability = treatment_dict[treatment_type]
-    
-    # No effect before onset days
-    if days_on_treatment < onset_days:
-        # Gradual onset effect (linear ramp up)
-        effect_strength = days_on_treatment / onset_days
-    else:
-        # Full effect after onset period
-        effect_strength = 1.0
+    profile = registry[treatment_type]
     
     # Effect diminishes after treatment duration
-    if days_on_treatment > duration_days:
-        return 0.0
+    if days_on_treatment > profile.duration_days:
+        return 0.0, registry
+    
+    # Precomputed onset ramp
+    effect_strength = profile.strength[days_on_treatment]
     
     # Add random variation in treatment response
-    patient_response = np.random.normal(1.0, variability)
+    if noise is not None:
+        standard_normal = noise.next()
+    else:
+        if rng is None:
+            rng = np.random.default_rng(seed)
+        standard_normal = rng.standard_normal()
+    patient_response = 1.0 + profile.variability * standard_normal
     effect_strength *= max(0.1, min(patient_response, 1.5))  # Limit variation
-    effect = max_effect * effect_strength
-    return effect, treatment_dict
\ No newline at end of file
+    effect = profile.max_effect * effect_strength
+    return effect, registry
+
+def _responding_treatment_codes(max_pain, avg_pain, dmard_use, window_days=7, treatment_types=TREATMENT_TYPES):
+    """
+    Vectorised version of _responding_treatment_type for a whole cohort
+    
+    Args:
+        max_pain: Array of the maximum pain over each patient's recent days
+        avg_pain: Array of the average pain over each patient's recent days
+        dmard_use: Array of DMARD counters per patient
+        window_days: Number of days the recent pain metrics cover
+        treatment_types: Treatment names in code order (e.g. TreatmentRegistry.types)
+        
+    Returns:
+        numpy.ndarray: Index into treatment_types per patient, -1 where no treatment is recommended
+    """
+    full_window = window_days >= FULL_WINDOW_DAYS
+    persistent = full_window & (avg_pain >= PERSISTENT_PAIN)
+    chronic_mild = full_window & (avg_pain >= CHRONIC_MILD_PAIN[0]) & (avg_pain < CHRONIC_MILD_PAIN[1])
+    escalated = np.where(dmard_use >= DMARD_ESCALATION_COUNT,
+                         treatment_types.index("biologic"),
+                         treatment_types.index("dmard"))
+
+    # Same priority order as the scalar decision logic, applied from the lowest priority up
+    codes = np.where(chronic_mild, treatment_types.index("physical_therapy"), -1)
+    codes = np.where(persistent, escalated, codes)
+    codes = np.where(max_pain >= SIGNIFICANT_PAIN, treatment_types.index("nsaid"), codes)
+    return np.where(max_pain >= SEVERE_PAIN, treatment_types.index("emergency_steroid"), codes)
+
+def _treatment_start_matrix(event_codes, days, registry=None):
+    """
+    Mark treatment starts for export in a single scatter, shifted back to when effects begin
+    
+    Args:
+        event_codes: Flat array of daily treatment codes (code + 1, 0 = none, flare bit removed), patients stacked day by day
+        days: Flat array with the day of each row
+        registry: TreatmentRegistry with the treatment profiles (default TREATMENT_REGISTRY)
+        
+    Returns:
+        numpy.ndarray: Boolean matrix (rows, treatments), True on the day each start takes effect
+    """
+    if registry is None:
+        registry = TREATMENT_REGISTRY
+    
+    onset_days = np.array([registry[t].onset_days for t in registry.types], dtype=np.int64)
+    start_rows = np.flatnonzero(event_codes)
+    codes = event_codes[start_rows].astype(np.int64) - 1
+    
+    # Adjust start day to when effects actually begin, dropping days before the data range
+    shift = onset_days[codes]
+    keep = days[start_rows] >= shift
+    
+    started = np.zeros((len(event_codes), len(onset_days)), dtype=bool)
+    started[start_rows[keep] - shift[keep], codes[keep]] = True
+    return started